@@ -0,0 +1,57 @@
+"""
+Benchmark block allocation cost versus volume fill level.
+
+Compares the original enumerate() scan of the free map with the
+cursor-based BlockAllocator on a full size 65535 block volume.
+
+    python benchmarks/bench_allocator.py
+"""
+from timeit import timeit
+from typing import Optional
+
+from bitarray import bitarray
+
+from prodos.allocator import BlockAllocator
+
+total_blocks = 65535
+batch = 256         # blocks allocated per trial, e.g. a 128Kb sapling file
+
+
+def enumerate_scan(free_map: bitarray) -> Optional[int]:
+    return next((i for (i, free) in enumerate(free_map) if free), None)
+
+
+def make_free_map(fill: float) -> bitarray:
+    free_map = bitarray(total_blocks)
+    free_map.setall(1)
+    free_map[:int(total_blocks * fill)] = 0
+    return free_map
+
+
+def bench_scan(fill: float) -> float:
+    free_map = make_free_map(fill)
+    def run():
+        for _ in range(batch):
+            i = enumerate_scan(free_map)
+            assert i is not None
+            free_map[i] = False
+    return timeit(run, number=1)
+
+
+def bench_allocator(fill: float, count: int=1) -> float:
+    alloc = BlockAllocator(make_free_map(fill), total_blocks)
+    def run():
+        for _ in range(batch // count):
+            alloc.allocate(count)
+    return timeit(run, number=1)
+
+
+if __name__ == '__main__':
+    print(f"usec per block allocated, {batch} blocks on {total_blocks} block volume")
+    print(f"{'fill':>6s} {'scan':>10s} {'cursor':>10s} {'cursor x256':>12s}")
+    for fill in (0, 0.25, 0.5, 0.75, 0.9, 0.99):
+        # each trial starts at the given fill level
+        scan = bench_scan(fill)
+        single = bench_allocator(fill)
+        multi = bench_allocator(fill, count=batch)
+        print(f"{fill:6.0%} {scan/batch*1e6:10.2f} {single/batch*1e6:10.2f} {multi/batch*1e6:12.2f}")
@@ -0,0 +1,221 @@
+"""
+Benchmark decoding and encoding a full volume catalog of directory entries.
+
+Compares FileEntry.unpack, which decodes only the storage type and name until
+another field is used, with an eager unpack that decodes every field up front
+like the original, and with an eager unpack into plain dict based dataclasses
+like the metadata classes before they used slots.  Reports CPU time per entry
+to unpack directory blocks, to touch every field (forcing a full decode), and
+to pack them again, along with the memory retained per fully decoded entry.
+Timings are the best of several interleaved runs, since a single run is noisy.
+
+    python benchmarks/bench_catalog.py
+"""
+import tracemalloc
+from dataclasses import dataclass
+from timeit import timeit
+from typing import Callable, Sequence
+
+from prodos.blocks import DirectoryBlock
+from prodos.globals import entries_per_block, entry_length
+from prodos.metadata import FileEntry, NamedEntry, StorageType
+from prodos.p8datetime import P8DateTime
+
+n_entries = entries_per_block * 1000
+repeat = 20
+
+
+def make_blocks() -> list[bytes]:
+    entries = [
+        FileEntry(
+            storage_type=StorageType.sapling,
+            file_name=f"FILE{i:05d}.TXT"[:15],
+            file_type=0x04,
+            key_pointer=1000 + i,
+            blocks_used=3,
+            eof=1000 + i,
+            created=P8DateTime(year=99, month=12, day=31, hour=23, minute=59),
+            aux_type=0x2000,
+            header_pointer=6,
+        )
+        for i in range(n_entries)
+    ]
+    return [
+        DirectoryBlock(prev_pointer=0, next_pointer=0, file_entries=entries[i:i+entries_per_block]).pack()
+        for i in range(0, n_entries, entries_per_block)
+    ]
+
+
+@dataclass(kw_only=True)
+class DictDateTime:
+    year: int
+    month: int
+    day: int
+    hour: int
+    minute: int
+
+    @classmethod
+    def unpack(cls, buf: bytes) -> "DictDateTime":
+        return cls(
+            year = buf[1] >> 1,
+            month = (buf[0] >> 5) + ((buf[1] & 1) << 3),
+            day = buf[0] & 0b11111,
+            hour = buf[3],
+            minute = buf[2],
+        )
+
+
+@dataclass(kw_only=True)
+class DictEntry:
+    """FileEntry's fields without slots, the baseline for memory use"""
+    storage_type: int
+    file_name: str
+    file_type: int
+    key_pointer: int
+    blocks_used: int
+    eof: int
+    created: DictDateTime
+    version: int
+    min_version: int
+    access: int
+    aux_type: int
+    last_mod: DictDateTime
+    header_pointer: int
+
+
+def dict_entry(buf: bytes) -> DictEntry:
+    (
+        file_type,
+        key_pointer,
+        blocks_used,
+        eofw,
+        eof3,
+        dt,
+        version,
+        min_version,
+        access,
+        aux_type,
+        mt,
+        header_pointer,
+    ) = FileEntry._struct.unpack(buf[NamedEntry.SIZE:])
+    return DictEntry(
+        storage_type=buf[0] >> 4,
+        file_name=buf[1:1 + (buf[0] & 0b1111)].decode('ascii', errors='ignore'),
+        file_type=file_type,
+        key_pointer=key_pointer,
+        blocks_used=blocks_used,
+        eof=eofw | (eof3 << 16),
+        created=DictDateTime.unpack(dt),
+        version=version,
+        min_version=min_version,
+        access=access,
+        aux_type=aux_type,
+        last_mod=DictDateTime.unpack(mt),
+        header_pointer=header_pointer,
+    )
+
+
+def eager_entry(buf: bytes) -> FileEntry:
+    n = NamedEntry.SIZE
+    (
+        file_type,
+        key_pointer,
+        blocks_used,
+        eofw,
+        eof3,
+        dt,
+        version,
+        min_version,
+        access,
+        aux_type,
+        mt,
+        header_pointer,
+    ) = FileEntry._struct.unpack(buf[n:])
+    return FileEntry(
+        storage_type=StorageType(buf[0] >> 4),
+        file_name=buf[1:1 + (buf[0] & 0b1111)].decode('ascii', errors='ignore'),
+        file_type=file_type,
+        key_pointer=key_pointer,
+        blocks_used=blocks_used,
+        eof=eofw | (eof3 << 16),
+        created=P8DateTime.unpack(dt),
+        version=version,
+        min_version=min_version,
+        access=access,
+        aux_type=aux_type,
+        last_mod=P8DateTime.unpack(mt),
+        header_pointer=header_pointer,
+    )
+
+
+def slots(blocks: list[bytes]) -> list[bytes]:
+    # the test catalog has no header entries
+    return [
+        b[offset:offset + entry_length]
+        for b in blocks
+        for offset in range(DirectoryBlock.SIZE, DirectoryBlock.SIZE + entries_per_block * entry_length, entry_length)
+    ]
+
+
+def dict_unpack(blocks: list[bytes]) -> list[DictEntry]:
+    return [dict_entry(buf) for buf in slots(blocks)]
+
+
+def eager_unpack(blocks: list[bytes]) -> list[FileEntry]:
+    return [eager_entry(buf) for buf in slots(blocks)]
+
+
+def lazy_unpack(blocks: list[bytes]) -> list[FileEntry]:
+    return [e for b in blocks for e in DirectoryBlock.unpack(b).file_entries]
+
+
+def touch(entries: Sequence[FileEntry | DictEntry]) -> int:
+    return sum(e.eof + e.created.year + e.last_mod.minute for e in entries)
+
+
+def pack(entries: list[FileEntry]) -> int:
+    return sum(len(e.pack()) for e in entries)
+
+
+def best(fs: dict[str, Callable[[], object]]) -> dict[str, float]:
+    """Best time per entry for each function, alternating between them"""
+    ts = {k: float('inf') for k in fs}
+    for _ in range(repeat):
+        for k, f in fs.items():
+            ts[k] = min(ts[k], timeit(f, number=1) / n_entries)
+    return ts
+
+
+def retained(unpack: Callable[[list[bytes]], Sequence[FileEntry | DictEntry]], blocks: list[bytes]) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = unpack(blocks)
+    touch(kept)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(kept)
+
+
+def main():
+    blocks = make_blocks()
+    eager, lazy = eager_unpack(blocks), lazy_unpack(blocks)
+    assert [e.pack() for e in eager] == [e.pack() for e in lazy]
+    touch(eager)
+    touch(lazy)
+
+    t_unpack = best(dict(
+        dicts=lambda: dict_unpack(blocks), eager=lambda: eager_unpack(blocks), lazy=lambda: lazy_unpack(blocks)))
+    t_touch = best(dict(
+        dicts=lambda: touch(dict_unpack(blocks)), eager=lambda: touch(eager_unpack(blocks)), lazy=lambda: touch(lazy_unpack(blocks))))
+    t_pack = best(dict(eager=lambda: pack(eager), lazy=lambda: pack(lazy)))
+
+    print(f"{n_entries} entries, best of {repeat}, usec/entry")
+    print(f"{'':18s} {'dicts':>8s} {'eager':>8s} {'lazy':>8s}")
+    for label, ts in (("unpack", t_unpack), ("unpack + decode", t_touch), ("pack", t_pack)):
+        print(f"{label:18s} " + ' '.join(f"{ts[k]*1e6:8.2f}" if k in ts else f"{'-':>8s}" for k in ('dicts', 'eager', 'lazy')))
+    memory = [retained(unpack, blocks) for unpack in (dict_unpack, eager_unpack, lazy_unpack)]
+    print(f"{'memory (bytes)':18s} " + ' '.join(f"{m:8.0f}" for m in memory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark round trips of index blocks.
+
+Compares the original list based IndexBlock, which builds its 256 pointers
+with a python comprehension over the lo/hi byte halves, with the array('H')
+based IndexBlock, which interleaves the halves with bytes slicing.
+
+    python benchmarks/bench_index.py
+"""
+import random
+from timeit import timeit
+
+from prodos.blocks import IndexBlock
+
+n = 10000
+
+
+def list_unpack(buf: bytes) -> list[int]:
+    return [lo + (hi << 8) for (lo, hi) in zip(buf[:256], buf[256:])]
+
+
+def list_pack(ps: list[int]) -> bytes:
+    ps = ps + [0]*(256 - len(ps))
+    return bytes([p & 0xff for p in ps] + [p >> 8 for p in ps])
+
+
+def report(label: str, t: float):
+    print(f"{label:20s} {t / n * 1e6:8.2f} usec/block")
+
+
+def main():
+    random.seed(1)
+    pointers = [random.randrange(0x10000) for _ in range(256)]
+    buf = list_pack(pointers)
+    assert IndexBlock(block_pointers=pointers).pack() == buf
+    assert list(IndexBlock.unpack(buf).block_pointers) == list_unpack(buf)
+
+    print(f"{n} index blocks")
+    report("list unpack", timeit(lambda: list_unpack(buf), number=n))
+    report("array unpack", timeit(lambda: IndexBlock.unpack(buf), number=n))
+    report("list pack", timeit(lambda: list_pack(pointers), number=n))
+    ps = IndexBlock.unpack(buf).block_pointers
+    report("array pack", timeit(lambda: IndexBlock(block_pointers=ps).pack(), number=n))
+    report("list iterate", timeit(lambda: sum(list_unpack(buf)), number=n))
+    report("array iterate", timeit(lambda: sum(IndexBlock.unpack(buf).block_pointers), number=n))
+
+
+if __name__ == '__main__':
+    main()
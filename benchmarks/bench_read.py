@@ -0,0 +1,76 @@
+"""
+Benchmark reading whole simple files into memory.
+
+Compares the original recursive b''.join reader, which copies the data
+once per index level and builds holes from lists of ints, with
+PlainFile.read_data, which copies a seedling's block directly and otherwise
+fills a single preallocated buffer in place via read_into.
+
+    python benchmarks/bench_read.py
+"""
+import tempfile
+from pathlib import Path
+from timeit import timeit
+
+from prodos.blocks import IndexBlock
+from prodos.device import BlockDevice
+from prodos.file import PlainFile
+from prodos.globals import block_size, block_size_bits
+from prodos.metadata import FileEntry
+from prodos.volume import Volume
+
+repeat = 50
+
+
+def join_read(device: BlockDevice, block_index: int, level: int, length: int) -> bytes:
+    if block_index == 0:
+        return bytes([0]*length)
+    if level == 1:
+        return device.read_block(block_index)[:length]
+    idx = device.read_typed_block(block_index, IndexBlock)
+    chunk_bits = block_size_bits + ((level-2) << 3)
+    chunk_size = 1 << chunk_bits
+    n = ((length-1) >> chunk_bits) + 1
+    return b''.join(
+        join_read(device, idx.block_pointers[j], level-1, min(length - j*chunk_size, chunk_size))
+        for j in range(n)
+    )
+
+
+def make_files(volume: Volume) -> dict[str, FileEntry]:
+    tree_size = 2 << 20
+    sparse = bytearray(tree_size)
+    for off in range(0, tree_size, 64 * block_size):
+        sparse[off:off+block_size] = b's' * block_size
+    files = dict(
+        seedling=b'x' * 500,
+        sapling=b'y' * 100 * block_size,
+        tree=bytes(range(256)) * (tree_size // 256),
+        sparse=bytes(sparse),
+    )
+    for name, data in files.items():
+        volume.root.add_simple_file(PlainFile(device=volume.device, file_name=name.upper(), data=data))
+    entries = {name: volume.root.file_entry(name.upper()) for name in files}
+    return {name: e for (name, e) in entries.items() if e}
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        volume = Volume.create(Path(tmp) / "bench.po", "BENCH", total_blocks=65535)
+        device = volume.device
+        print(f"msec per read, best of {repeat}")
+        print(f"{'file':>10s} {'eof':>9s} {'join':>8s} {'into':>8s}")
+        for name, entry in make_files(volume).items():
+            assert join_read(device, entry.key_pointer, entry.storage_type, entry.eof) \
+                == PlainFile.from_entry(device, entry).data
+            # repeat small reads enough to time them reliably
+            number = max(1, (1 << 20) // entry.eof)
+            join = min(
+                timeit(lambda: join_read(device, entry.key_pointer, entry.storage_type, entry.eof), number=number)
+                for _ in range(repeat)
+            ) / number
+            into = min(
+                timeit(lambda: PlainFile.read_data(device, entry), number=number)
+                for _ in range(repeat)
+            ) / number
+            print(f"{name:>10s} {entry.eof:9d} {join*1e3:8.4f} {into*1e3:8.4f}")
@@ -0,0 +1,51 @@
+"""
+Benchmark the block storage backends.
+
+For each backend we create a 32Mb volume, import a batch of files
+in a transaction, which flushes the image to the host file at the end,
+and read them all back.
+
+    python benchmarks/bench_storage.py
+"""
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import get_args
+
+from prodos.file import PlainFile
+from prodos.storage import StorageBackend
+from prodos.volume import Volume
+
+n_files = 200
+file_size = 24 << 10
+
+
+def run(backend: StorageBackend, tmpdir: Path) -> list[float]:
+    data = bytes(range(256)) * (file_size // 256)
+    img_path = tmpdir / f"{backend}.po"
+    times = [perf_counter()]
+    volume = Volume.create(img_path, "BENCH", backend=backend)
+    times.append(perf_counter())
+    with volume.transaction():
+        for i in range(n_files):
+            with volume.create_file(f'/F{i}') as f:
+                f.write(data)
+    times.append(perf_counter())
+    for i in range(n_files):
+        entry = volume.path_entry(f'/F{i}')
+        assert entry and len(PlainFile.from_entry(volume.device, entry).data) == file_size
+    times.append(perf_counter())
+    return [b - a for (a, b) in zip(times, times[1:])]
+
+
+def main():
+    print(f"{n_files} files of {file_size} bytes, times in seconds")
+    print(f"{'backend':>8s} {'create':>8s} {'write':>8s} {'read':>8s}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for backend in get_args(StorageBackend):
+            ts = run(backend, Path(tmpdir))
+            print(f"{backend:>8s} " + ' '.join(f"{t:8.3f}" for t in ts))
+
+
+if __name__ == '__main__':
+    main()
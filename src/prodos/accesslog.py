@@ -0,0 +1,143 @@
+from array import array
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, Literal, NamedTuple, Optional, TextIO
+
+AccessT = Literal['r', 'w', 'a', 'f']
+
+
+class AccessLogEntry(NamedTuple):
+    access_type: AccessT
+    block_index: int
+    block_type: str
+
+    def __str__(self):
+        return f"{self.access_type} {self.block_index:04x} {self.block_type}"
+
+
+class AccessLog:
+    """
+    Log of block device accesses, by default an unbounded list of entries.
+
+    Entries are numbered in order of arrival so that a mark from
+    BlockDevice.mark_session stays valid however the log is stored.
+    Subclasses may only retain recent entries, or none at all,
+    in which case asking for entries older than those retained is an error
+    rather than silently returning a partial log.
+    """
+    def __init__(self):
+        self.count = 0      # total number of entries ever appended
+        self._entries: list[AccessLogEntry] = []
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def first(self) -> int:
+        """Sequence number of the oldest retained entry"""
+        return self.count - len(self._entries)
+
+    def append(self, access_type: AccessT, block_index: int, block_type: str=''):
+        self._entries.append(AccessLogEntry(access_type, block_index, block_type))
+        self.count += 1
+
+    def entries(self, mark: int=0) -> Iterable[AccessLogEntry]:
+        """Return the entries logged since mark"""
+        self._check_mark(mark)
+        return self._entries[mark - self.first:]
+
+    def close(self):
+        pass
+
+    def _check_mark(self, mark: int):
+        if mark < self.first:
+            raise LookupError(
+                f"{type(self).__name__}: entries since {mark} not retained, oldest is {self.first}"
+            )
+
+
+class NullAccessLog(AccessLog):
+    """Disabled log which only counts accesses"""
+    def append(self, access_type: AccessT, block_index: int, block_type: str=''):
+        self.count += 1
+
+
+class RingAccessLog(AccessLog):
+    """Fixed size log which retains the most recent maxlen entries"""
+    def __init__(self, maxlen: int):
+        super().__init__()
+        self._ring: deque[AccessLogEntry] = deque(maxlen=maxlen)
+
+    @property
+    def first(self) -> int:
+        return self.count - len(self._ring)
+
+    def append(self, access_type: AccessT, block_index: int, block_type: str=''):
+        self._ring.append(AccessLogEntry(access_type, block_index, block_type))
+        self.count += 1
+
+    def entries(self, mark: int=0) -> Iterable[AccessLogEntry]:
+        self._check_mark(mark)
+        return islice(self._ring, mark - self.first, None)
+
+
+class CompactAccessLog(AccessLog):
+    """
+    Unbounded log stored as a single array('I') column, with each entry packed as
+
+        bits 31-18: block type id | bits 17-16: access type | bits 15-0: block index
+
+    which costs four bytes per entry rather than a tuple of python objects.
+    """
+    _access_types: tuple[AccessT, ...] = ('r', 'w', 'a', 'f')
+    _access_ids = {t: i for (i, t) in enumerate(_access_types)}
+
+    def __init__(self):
+        super().__init__()
+        self._packed = array('I')
+        assert self._packed.itemsize == 4, "CompactAccessLog: expected four byte array('I')"
+        self._block_types: list[str] = []
+        self._block_type_ids: dict[str, int] = {}
+
+    @property
+    def first(self) -> int:
+        return 0
+
+    def append(self, access_type: AccessT, block_index: int, block_type: str=''):
+        type_id = self._block_type_ids.get(block_type)
+        if type_id is None:
+            type_id = self._block_type_ids[block_type] = len(self._block_types)
+            self._block_types.append(block_type)
+        self._packed.append((type_id << 18) | (self._access_ids[access_type] << 16) | block_index)
+        self.count += 1
+
+    def entries(self, mark: int=0) -> Iterator[AccessLogEntry]:
+        self._check_mark(mark)
+        return (
+            AccessLogEntry(self._access_types[(v >> 16) & 3], v & 0xffff, self._block_types[v >> 18])
+            for v in islice(self._packed, mark, None)
+        )
+
+
+class StreamAccessLog(RingAccessLog):
+    """
+    Log which writes each entry to a text file as it happens,
+    in the same format as BlockDevice.write_access_log,
+    retaining only the most recent tail entries in memory.
+    Entries after close are counted but no longer written.
+    """
+    def __init__(self, log_path: Path, tail: int=0):
+        super().__init__(tail)
+        self.log_path = log_path
+        self._file: Optional[TextIO] = open(log_path, 'w')
+
+    def append(self, access_type: AccessT, block_index: int, block_type: str=''):
+        super().append(access_type, block_index, block_type)
+        if self._file:
+            self._file.write(f"{access_type} {block_index:04x} {block_type}\n")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,101 @@
+from itertools import islice
+from typing import Final, Iterator, Optional
+
+from bitarray import bitarray
+
+from .globals import block_size_bits
+
+# each bitmap block covers 4096 volume blocks
+bitmap_block_bits: Final = block_size_bits + 3
+
+
+class BlockAllocator:
+    """
+    First-fit block allocator over the volume free map,
+    where a set bit marks a free block.
+
+    We keep a cursor with no free blocks below it, so each allocation resumes
+    bitarray's native search where the last one stopped instead of rescanning
+    the whole map.  Freeing a block pulls the cursor back, so we still always
+    hand out the lowest free block like the ProDOS kernel does.
+
+    We also keep an exact count of free blocks, and the set of bitmap blocks
+    (4096 bits each) changed since they were last written, so the device
+    neither recounts the whole map nor rewrites all of it.
+
+    Callers should update the map via mark_used/mark_free so the cursor,
+    count and dirty set stay valid.
+    """
+    def __init__(self, free_map: bitarray, total_blocks: int):
+        self.free_map = free_map
+        self.total_blocks = total_blocks
+        self.cursor = 0
+        self.free_count = free_map.count(1, 0, total_blocks)
+        self.dirty: set[int] = set()
+
+    def reset(self):
+        """Restart the search and recount after the free map has been reloaded"""
+        self.cursor = 0
+        self.free_count = self.free_map.count(1, 0, self.total_blocks)
+        self.dirty.clear()
+
+    def mark_all_dirty(self):
+        self.dirty.update(range(((len(self.free_map) - 1) >> bitmap_block_bits) + 1))
+
+    def next_free(self) -> Optional[int]:
+        i = self.free_map.find(1, self.cursor, self.total_blocks)
+        self.cursor = i if i >= 0 else self.total_blocks
+        return i if i >= 0 else None
+
+    def allocate(self, count: int=1) -> list[int]:
+        """Allocate the first count free blocks, in ascending order"""
+        blocks = list(islice(self.free_map.search(1, self.cursor, self.total_blocks), count))
+        assert len(blocks) == count, f"allocate: Device full! Only {len(blocks)} of {count} blocks free"
+        for i in blocks:
+            self.free_map[i] = False
+            self.dirty.add(i >> bitmap_block_bits)
+        if blocks:
+            self.cursor = blocks[-1] + 1
+        self.free_count -= count
+        return blocks
+
+    def allocate_extent(self, count: int) -> list[int]:
+        """
+        Allocate count contiguous blocks from the smallest free run that fits,
+        preferring the lowest such run, so larger runs stay available for larger files.
+        If no single run is long enough, fall back to first-fit blocks.
+        """
+        best: Optional[tuple[int, int]] = None
+        for (start, length) in self.free_runs():
+            if length >= count and (best is None or length < best[1]):
+                best = (start, length)
+                if length == count:
+                    break
+        if best is None:
+            return self.allocate(count)
+        start = best[0]
+        self.free_map[start:start+count] = False
+        self.dirty.update(range(start >> bitmap_block_bits, ((start + count - 1) >> bitmap_block_bits) + 1))
+        self.free_count -= count
+        return list(range(start, start+count))
+
+    def free_runs(self) -> Iterator[tuple[int, int]]:
+        """Generate (start, length) for each run of free blocks in ascending order"""
+        i = self.cursor
+        while (start := self.free_map.find(1, i, self.total_blocks)) >= 0:
+            end = self.free_map.find(0, start, self.total_blocks)
+            i = end if end >= 0 else self.total_blocks
+            yield (start, i - start)
+
+    def mark_used(self, block_index: int):
+        if self.free_map[block_index]:
+            self.free_map[block_index] = False
+            self.free_count -= 1
+            self.dirty.add(block_index >> bitmap_block_bits)
+
+    def mark_free(self, block_index: int):
+        if not self.free_map[block_index]:
+            self.free_map[block_index] = True
+            self.free_count += 1
+            self.dirty.add(block_index >> bitmap_block_bits)
+        self.cursor = min(self.cursor, block_index)
@@ -1,37 +1,39 @@
 import logging
 import struct
+import sys
+from array import array
 from dataclasses import dataclass
-from typing import ClassVar, Optional, Self
+from typing import ClassVar, Optional, Self, Sequence
 
 from bitarray import bitarray
 
-from .globals import block_size, entries_per_block, entry_length
+from .globals import ByteBuffer, block_size, entries_per_block, entry_length
 from .metadata import (
     DirectoryEntry,
     DirectoryHeaderEntry,
     ExtendedForkEntry,
     FileEntry,
-    NamedEntry,
     StorageType,
     SubdirectoryHeaderEntry,
-    VolumeDirectoryHeaderEntry
+    VolumeDirectoryHeaderEntry,
+    storage_types
 )
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class AbstractBlock:
     def pack(self) -> bytes:
         return NotImplemented
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         return NotImplemented
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class DirectoryBlock(AbstractBlock):
     SIZE: ClassVar = 4
-    _struct: str = "<HH"
+    _struct: ClassVar = struct.Struct("<HH")
     _header_factory: ClassVar[dict[StorageType, type[DirectoryHeaderEntry]]] = {
         StorageType.voldirhdr: VolumeDirectoryHeaderEntry,
         StorageType.subdirhdr: SubdirectoryHeaderEntry
@@ -43,7 +45,7 @@ class DirectoryBlock(AbstractBlock):
     file_entries: list[FileEntry]
 
     def pack(self) -> bytes:
-        data = struct.pack(DirectoryBlock._struct, self.prev_pointer, self.next_pointer)
+        data = DirectoryBlock._struct.pack(self.prev_pointer, self.next_pointer)
         if self.header_entry:
             data += self.header_entry.pack()
         data += b''.join(e.pack() for e in self.file_entries)
@@ -54,15 +56,15 @@ class DirectoryBlock(AbstractBlock):
         return data + bytes(padding)
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         offset = cls.SIZE
         (
             prev_pointer, next_pointer
-        ) = struct.unpack(cls._struct, buf[:offset])
-        # check the start of the first entry to see if it's a header entry
-        d = NamedEntry.unpack(buf[offset:offset + NamedEntry.SIZE])
+        ) = cls._struct.unpack(buf[:offset])
+        # check the storage type of the first entry to see if it's a header entry
         header: Optional[DirectoryEntry] = None
-        header_factory = cls._header_factory.get(d.storage_type)
+        storage_type = buf[offset] >> 4
+        header_factory = cls._header_factory.get(StorageType(storage_type)) if storage_type in storage_types else None
         if header_factory:
             header = header_factory.unpack(buf[offset:offset + entry_length])
             offset += entry_length
@@ -83,25 +85,38 @@ class DirectoryBlock(AbstractBlock):
         )
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class IndexBlock(AbstractBlock):
     """
     index blocks store up to 256 two byte block pointers,
     with the LSBs in bytes 0-255 and the MSBs in bytes 256-511
+
+    Unpacked pointers are an array('H'), built by interleaving the two halves
+    with bytes slicing rather than combining 256 pairs of ints in python.
+    Any sequence of ints can be packed, shorter ones being padded with nil pointers.
     """
-    block_pointers: list[int]
+    block_pointers: Sequence[int]
 
     def pack(self) -> bytes:
         ps = self.block_pointers
         assert len(ps) <= 256, f"IndexBlock.pack: too many pointers {len(ps)}"
-        ps += [0]*(256 - len(ps))
-        return bytes([p & 0xff for p in ps] + [p >> 8 for p in ps])
+        # copy so we never pad or byteswap the caller's pointers
+        words = array('H', ps)
+        words.extend(bytes(256 - len(ps)))
+        if sys.byteorder == 'big':
+            words.byteswap()
+        raw = words.tobytes()
+        return raw[0::2] + raw[1::2]
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
-        return cls(block_pointers=[
-            lo + (hi<<8) for (lo, hi) in zip(buf[:256], buf[256:])
-        ])
+    def unpack(cls, buf: ByteBuffer) -> Self:
+        raw = bytearray(512)
+        raw[0::2] = buf[:256]
+        raw[1::2] = buf[256:512]
+        ps = array('H', raw)
+        if sys.byteorder == 'big':
+            ps.byteswap()
+        return cls(block_pointers=ps)
 
 
 @dataclass(kw_only=True)
@@ -119,9 +134,9 @@ class BitmapBlock(AbstractBlock):
         return self.free_map.tobytes()
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         bits = bitarray()
-        bits.frombytes(buf)
+        bits.frombytes(bytes(buf))
         return cls(free_map=bits)
 
 
@@ -149,7 +164,7 @@ class ExtendedKeyBlock(AbstractBlock):
         return data
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         return cls(
             data_fork=ExtendedForkEntry.unpack(buf),
             resource_fork=ExtendedForkEntry.unpack(buf[256:])
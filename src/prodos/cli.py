@@ -10,9 +10,12 @@ import typer
 from typer import Argument, Option
 from typer_di import Depends, TyperDI
 
-from prodos.device import DeviceFormat, DeviceMode
+from prodos.accesslog import AccessLog, NullAccessLog, StreamAccessLog
+from prodos.device import DeviceFormat, DeviceMode, FreePolicy
+from prodos.directory import DirectoryFile
 from prodos.file import PlainFile, legal_path
 from prodos.metadata import FileEntry, StorageType
+from prodos.stream import copy_sparse
 from prodos.volmap import format_block_map, format_legend, walk_volume
 from prodos.volume import Volume
 
@@ -51,16 +54,26 @@ def get_host_paths(paths: Annotated[list[str], Argument(help="Host file path(s)"
     return paths
 
 @contextmanager
-def open_volume(source: Path, output: Path|None=None, mode: DeviceMode='ro', log: Path|None=None):
+def open_volume(source: Path, output: Path|None=None, mode: DeviceMode='ro', log: Path|None=None,
+        free_policy: FreePolicy=FreePolicy.zero):
     if output:
         shutil.copy(source, output)
         source = output
-    volume = Volume.from_file(source, mode=mode)
+    access_log = open_access_log(log)
     try:
-        yield volume
+        volume = Volume.from_file(source, mode=mode, access_log=access_log, free_policy=free_policy)
+        try:
+            yield volume
+        finally:
+            # flush first so the free map write-back is logged too
+            volume.device.flush()
     finally:
-        if log:
-            volume.device.write_access_log(log)
+        access_log.close()
+
+
+def open_access_log(log: Path|None) -> AccessLog:
+    """Stream the access log to file as we go if requested, otherwise just count accesses"""
+    return StreamAccessLog(log) if log else NullAccessLog()
 
 
 def _split_path(path: str) -> tuple[str, str]:
@@ -76,6 +89,7 @@ def create(
         size: Annotated[int, Option("--size", "-s", help="Total blocks (512 bytes/block)")] = 65535,
         name: Annotated[str, Option("--name", "-n", help="Volume name (max 15 chars)")] = 'PYP8',
         format: Annotated[DeviceFormat, Option("--format", "-t", help="Disk image format")] = DeviceFormat.prodos,
+        preallocate: Annotated[bool, Option("--preallocate", help="Reserve host disk space rather than creating a sparse image")] = False,
         force: bool = Depends(get_force),
         log: Path|None = Depends(get_log),
     ):
@@ -91,16 +105,20 @@ def create(
             raise typer.Exit(5)
         os.remove(dest)
 
-    volume = Volume.create(
-        dest=dest,
-        volume_name=name,
-        total_blocks=size,
-        format=format,
-        loader_path=None,
-    )
-
-    if log:
-        volume.device.write_access_log(log)
+    access_log = open_access_log(log)
+    try:
+        volume = Volume.create(
+            dest=dest,
+            volume_name=name,
+            total_blocks=size,
+            format=format,
+            loader_path=None,
+            access_log=access_log,
+            preallocate=preallocate,
+        )
+        volume.device.flush()
+    finally:
+        access_log.close()
 
 
 @app.command()
@@ -211,31 +229,32 @@ def cp(
             print(f"Target {dst} is not a directory")
             raise typer.Exit(1)
 
-        for e in entries:
-            if e.is_dir:
-                print(f"Omitting directory {e.file_name}")
-                continue
+        with volume.transaction():
+            for e in entries:
+                if e.is_dir:
+                    print(f"Omitting directory {e.file_name}")
+                    continue
 
-            if is_dst_dir:
-                assert dst_entry # for typing
-                dest_dir = volume.read_directory(dst_entry)
-                dest_name = e.file_name
-            else:
-                parent_path, name = _split_path(dst)
-                parent_entry = volume.path_entry(parent_path)
-                if not parent_entry or not parent_entry.is_dir:
-                     print(f"Parent directory {parent_path} not found")
-                     raise typer.Exit(1)
-                dest_dir = volume.read_directory(parent_entry)
-                dest_name = legal_path(name)
-
-            f_src = volume.read_simple_file(e)
-            f_dst = PlainFile(
-                device=volume.device,
-                file_name=dest_name,
-                data=f_src.data
-            )
-            dest_dir.add_simple_file(f_dst)
+                if is_dst_dir:
+                    assert dst_entry # for typing
+                    dest_dir = volume.read_directory(dst_entry)
+                    dest_name = e.file_name
+                else:
+                    parent_path, name = _split_path(dst)
+                    parent_entry = volume.path_entry(parent_path)
+                    if not parent_entry or not parent_entry.is_dir:
+                         print(f"Parent directory {parent_path} not found")
+                         raise typer.Exit(1)
+                    dest_dir = volume.read_directory(parent_entry)
+                    dest_name = legal_path(name)
+
+                f_src = volume.read_simple_file(e)
+                f_dst = PlainFile(
+                    device=volume.device,
+                    file_name=dest_name,
+                    data=f_src.data
+                )
+                dest_dir.add_simple_file(f_dst)
 
 
 @app.command()
@@ -269,31 +288,38 @@ def mv(
             print(f"Target {dst} is not a directory")
             raise typer.Exit(1)
 
-        for e in entries:
-            if is_dst_dir:
-                assert dst_entry # for typing
-                dest_dir = volume.read_directory(dst_entry)
-                dest_name = e.file_name
-            else:
-                parent_path, name = _split_path(dst)
-                parent_entry = volume.path_entry(parent_path)
-                if not parent_entry or not parent_entry.is_dir:
-                     print(f"Parent directory {parent_path} not found")
-                     raise typer.Exit(1)
-                dest_dir = volume.read_directory(parent_entry)
-                dest_name = legal_path(name)
-
-            src_dir = volume.parent_directory(e)
-
-            # Use the appropriate move method based on file type
-            try:
-                if e.is_dir:
-                    src_dir.move_directory(e, dest_dir, dest_name)
+        with volume.transaction():
+            emptied: dict[int, DirectoryFile] = {}
+            for e in entries:
+                if is_dst_dir:
+                    assert dst_entry # for typing
+                    dest_dir = volume.read_directory(dst_entry)
+                    dest_name = e.file_name
                 else:
-                    src_dir.move_simple_file(e, dest_dir, dest_name)
-            except ValueError as ex:
-                print(str(ex))
-                raise typer.Exit(1)
+                    parent_path, name = _split_path(dst)
+                    parent_entry = volume.path_entry(parent_path)
+                    if not parent_entry or not parent_entry.is_dir:
+                         print(f"Parent directory {parent_path} not found")
+                         raise typer.Exit(1)
+                    dest_dir = volume.read_directory(parent_entry)
+                    dest_name = legal_path(name)
+
+                src_dir = volume.parent_directory(e)
+
+                # Use the appropriate move method based on file type
+                try:
+                    if e.is_dir:
+                        src_dir.move_directory(e, dest_dir, dest_name)
+                    else:
+                        src_dir.move_simple_file(e, dest_dir, dest_name)
+                except ValueError as ex:
+                    print(str(ex))
+                    raise typer.Exit(1)
+                if src_dir.block_list[0] != dest_dir.block_list[0]:
+                    emptied[src_dir.block_list[0]] = src_dir
+            # reclaim slots we moved out of once per directory
+            for dir in emptied.values():
+                dir.compact()
 
 
 @app.command()
@@ -301,12 +327,13 @@ def rm(
         source: Path = Depends(get_volume_path),
         src: list[str] = Depends(get_paths),
         output: Path|None = Depends(get_output),
+        free_policy: Annotated[FreePolicy, Option("--free-policy", help="How to clear freed blocks: zero now, lazy (don't), on reuse, or punch host holes")] = FreePolicy.zero,
         log: Path|None = Depends(get_log),
     ):
     """
     Remove simple file(s) at SRC
     """
-    with open_volume(source, output, mode='rw', log=log) as volume:
+    with open_volume(source, output, mode='rw', log=log, free_policy=free_policy) as volume:
         entries = volume.glob_paths(src)
         if not entries:
             print("No matching files found")
@@ -317,9 +344,14 @@ def rm(
                 print(f"Not a simple file: {e.file_name}")
                 raise typer.Exit(1)
 
-        for e in entries:
-            dir = volume.parent_directory(e)
-            dir.remove_simple_file(e)
+        with volume.transaction():
+            dirs: dict[int, DirectoryFile] = {}
+            for e in entries:
+                dir = dirs[e.header_pointer] = volume.parent_directory(e)
+                dir.remove_simple_file(e)
+            # reclaim emptied slots once per directory
+            for dir in dirs.values():
+                dir.compact()
 
 
 @app.command()
@@ -384,7 +416,9 @@ def rmdir(
             raise typer.Exit(1)
 
         parent = volume.parent_directory(entry)
-        parent.remove_directory(entry)
+        with volume.transaction():
+            parent.remove_directory(entry)
+            parent.compact()
 
 
 @app.command('import')
@@ -443,24 +477,21 @@ def host_import(
         # Now we have a single entry and possibly a target_name
         dir = volume.read_directory(target)
 
-        for fname in src:
-            name = legal_path(renamed or path.basename(fname))
-            entry = dir.file_entry(name)
-            if entry:
-                if entry.is_dir:
-                    print(f"Target {name} is a directory")
-                    raise typer.Exit(4)
-                elif not force:
-                    print(f"Target file {name} exists, use --force to overwrite")
-                    raise typer.Exit(5)
-                else:
-                    dir.remove_simple_file(entry)
-            f = PlainFile(
-                device=volume.device,
-                file_name=name,
-                data=open(fname, 'rb').read()
-            )
-            dir.add_simple_file(f)
+        with volume.transaction():
+            for fname in src:
+                name = legal_path(renamed or path.basename(fname))
+                entry = dir.file_entry(name)
+                if entry:
+                    if entry.is_dir:
+                        print(f"Target {name} is a directory")
+                        raise typer.Exit(4)
+                    elif not force:
+                        print(f"Target file {name} exists, use --force to overwrite")
+                        raise typer.Exit(5)
+                    else:
+                        dir.remove_simple_file(entry)
+                with open(fname, 'rb') as src_file, dir.create_file(name) as f:
+                    copy_sparse(src_file, f)
 
 
 @app.command('export')
@@ -509,7 +540,7 @@ def host_export(
 
             out = dst if not is_dir else path.join(dst, e.file_name)
             if e.is_plain_file:
-                volume.read_simple_file(e).export(out)
+                PlainFile.export_entry(volume.device, e, out)
             elif e.storage_type == StorageType.extended:
                 volume.read_extended_file(e).export(out)
             else:
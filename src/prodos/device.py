@@ -1,15 +1,20 @@
+import errno
 import logging
+import os
 import struct
+from collections import OrderedDict
 from enum import Enum
-from mmap import ACCESS_READ, ACCESS_WRITE, mmap
 from os import path
 from pathlib import Path
-from typing import Literal, NamedTuple, Optional, Type, TypeVar
+from typing import BinaryIO, Iterable, Literal, NamedTuple, Optional, Type, TypeVar, cast
 
 from bitarray import bitarray
 
+from .accesslog import AccessLog, AccessLogEntry
+from .allocator import BlockAllocator
 from .blocks import AbstractBlock, BitmapBlock
 from .globals import block_size, block_size_bits
+from .storage import BlockStorage, MemoryStorage, StorageBackend, open_storage
 
 
 class DeviceFormat(str, Enum):
@@ -20,26 +25,55 @@ class DeviceFormat(str, Enum):
 DeviceMode = Literal['ro', 'rw']
 
 
+class FreePolicy(str, Enum):
+    """How BlockDevice.free_block treats the contents of freed blocks"""
+    zero = "zero"       # zero each block as it's freed
+    lazy = "lazy"       # leave the old contents in place
+    reuse = "reuse"     # zero blocks when they're next allocated
+    punch = "punch"     # zero on flush, punching host holes where possible
+
+
 BlockT = TypeVar('BlockT', bound=AbstractBlock)
-AccessT = Literal['r', 'w', 'a', 'f']
 
 
-class AccessLogEntry(NamedTuple):
-    access_type: AccessT
-    block_index: int
-    block_type: str
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
 
 
 class BlockDevice:
     _struct_2mg = "<4s4sHHI48x"
 
-    def __init__(self, source: Path, mode: DeviceMode='ro', bit_map_pointer: Optional[int]=None):
+    def __init__(self,
+            source: Path,
+            mode: DeviceMode='ro',
+            bit_map_pointer: Optional[int]=None,
+            cache_size: int=0,
+            access_log: Optional[AccessLog]=None,
+            mapped_free_map: bool=False,
+            backend: StorageBackend='mmap',
+            storage: Optional[BlockStorage]=None,
+            free_policy: FreePolicy=FreePolicy.zero,
+        ):
         self.source = source
-        access = ACCESS_WRITE if mode == 'rw' else ACCESS_READ
-        f = open(source, 'r+b' if mode == 'rw' else 'rb', buffering=0)
-        self.mm = mmap(f.fileno(), 0, access=access)
+        # see storage.py for mmap, pread/pwrite and in-memory backends
+        self.storage = storage if storage is not None else open_storage(source, mode, backend)
         self.skip = 0
-        self._access_log: list[AccessLogEntry] = []
+        # see accesslog.py for bounded, compact, streamed or disabled logs
+        self._access_log = access_log if access_log is not None else AccessLog()
+        self.free_policy = free_policy
+        self._unzeroed: set[int] = set()     # freed blocks still to be zeroed, see FreePolicy
+
+        # optional LRU cache of decoded blocks keyed by (block_index, factory).
+        # Cached blocks are shared, so callers must write back any changes
+        # (which invalidates the entry) rather than mutating them in place.
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache: OrderedDict[tuple[int, type[AbstractBlock]], AbstractBlock] = OrderedDict()
+        self._cache_factories: set[type[AbstractBlock]] = set()
 
         if source.suffix.lower() == '.2mg':
             # 2mg files contain a 64 byte header before the volume data
@@ -50,25 +84,42 @@ class BlockDevice:
                 size,
                 version,    # type: ignore  # not currently used
                 format
-            ) = struct.unpack_from(self._struct_2mg, self.mm)
+            ) = struct.unpack_from(self._struct_2mg, self.storage.view(0, 64))
             assert ident == b'2IMG' and format == 1, "BlockDevice: Can't handle non-prodos .2mg volume"
             self.skip = size
 
-        n = len(self.mm)
+        n = len(self.storage)
         n -= self.skip
         assert n & (block_size - 1) == 0,\
             f"BlockDevice: Expected volume {source} size {n} excluding {self.skip} byte prefix to be multiple of {block_size} bytes"
         self.total_blocks = n >> block_size_bits
 
+        # With mapped_free_map the free map is a bitarray over the bitmap blocks
+        # in the mmap itself, rather than a copy read by reset_free_map and
+        # written back by write_free_map, so allocations update the volume in place.
+        self.mapped_free_map = mapped_free_map
         self.bit_map_pointer = bit_map_pointer     # updated via set_free_map below
         k = block_size_bits + 3
-        self.free_map = bitarray(self.bitmap_blocks << k)
-        self.free_map[:self.total_blocks] = 1
+        if mapped_free_map and bit_map_pointer is not None:
+            # the volume's own bitmap, so we leave it as is, see create
+            self._map_free_map()
+        else:
+            self.free_map = bitarray(self.bitmap_blocks << k)
+            self.free_map[:self.total_blocks] = 1
+        self.allocator = BlockAllocator(self.free_map, self.total_blocks)
 
     def __del__(self):
-        if self.get_access_log('af'):
+        # __init__ may have failed before there was anything to flush
+        if hasattr(self, 'allocator'):
+            self.flush()
+
+    def flush(self):
+        """Write back any changed bitmap blocks, and flush the device"""
+        if self.free_policy == FreePolicy.punch and self._unzeroed:
+            self._discard_freed()
+        if self.allocator.dirty:
             self.write_free_map()
-        self.mm.flush()
+        self.storage.flush()
 
     def __repr__(self):
         used = 1 - self.blocks_free/self.total_blocks
@@ -80,19 +131,46 @@ class BlockDevice:
             total_blocks: int,
             bit_map_pointer: int,
             format: DeviceFormat = DeviceFormat.prodos,
+            access_log: Optional[AccessLog] = None,
+            mapped_free_map: bool = False,
+            backend: StorageBackend = 'mmap',
+            preallocate: bool = False,
         ):
+        """
+        Create a blank image, which the memory backend builds in memory until flush.
+        Image files are sized without writing their zeros, so they're sparse
+        on hosts which support it, unless we preallocate their space.
+        """
         if format == DeviceFormat.twomg:
             prefix = struct.pack(cls._struct_2mg, b'2IMG', b'PYP8', 64, 1, 1)
         else:
             prefix = bytes()
 
         assert not path.exists(dest), f"Device.create: {dest} already exists!"
-        open(dest, 'wb').write(prefix + bytes([0]*total_blocks*block_size))
-        return BlockDevice(dest, mode='rw', bit_map_pointer=bit_map_pointer)
+        size = len(prefix) + total_blocks*block_size
+        storage: Optional[BlockStorage] = None
+        if backend == 'memory':
+            data = bytearray(size)
+            data[:len(prefix)] = prefix
+            storage = MemoryStorage(data, dest)
+        else:
+            with open(dest, 'wb') as f:
+                f.write(prefix)
+                f.truncate(size)
+                if preallocate:
+                    _preallocate(f, size)
+        device = BlockDevice(dest, mode='rw', bit_map_pointer=bit_map_pointer,
+            access_log=access_log, mapped_free_map=mapped_free_map, backend=backend, storage=storage)
+        # the new bitmap is all zeros on disk, so start with every block free,
+        # and every block of the bitmap needing writing
+        device.free_map[:total_blocks] = 1
+        device.allocator.reset()
+        device.allocator.mark_all_dirty()
+        return device
 
     @property
     def blocks_free(self) -> int:
-        return sum(self.free_map)
+        return self.allocator.free_count
 
     @property
     def bitmap_blocks(self) -> int:
@@ -100,86 +178,225 @@ class BlockDevice:
         k = block_size_bits + 3
         return ((self.total_blocks - 1) >> k) + 1
 
+    def cache_info(self) -> CacheInfo:
+        """Report decoded block cache statistics, cf. functools.lru_cache"""
+        return CacheInfo(self.cache_hits, self.cache_misses, self.cache_size, len(self._cache))
+
+    def cache_clear(self):
+        self._cache.clear()
+        self.cache_hits = self.cache_misses = 0
+
+    def _cache_invalidate(self, block_index: int):
+        for factory in self._cache_factories:
+            self._cache.pop((block_index, factory), None)
+
     def mark_session(self) -> int:
         return len(self._access_log)
 
     def get_access_log(self, access_types: str, mark: int=0) -> list[int]:
-        return [entry.block_index for entry in self._access_log[mark:] if entry.access_type in access_types]
+        return [entry.block_index for entry in self._access_log.entries(mark) if entry.access_type in access_types]
 
     def get_typed_access_log(self, access_types: str, mark: int=0) -> list[tuple[int, str]]:
         """Get access log entries with block types for given access types."""
-        return [(entry.block_index, entry.block_type) for entry in self._access_log[mark:] if entry.access_type in access_types]
+        return [(entry.block_index, entry.block_type) for entry in self._access_log.entries(mark) if entry.access_type in access_types]
 
     def write_access_log(self, log_path: Path):
-        """Write access log to file."""
+        """Write (retained) access log entries to file."""
         with open(log_path, 'w') as f:
-            for entry in self._access_log:
-                f.write(f"{entry.access_type} {entry.block_index:04x} {entry.block_type}\n")
+            for entry in self._access_log.entries(self._access_log.first):
+                f.write(f"{entry}\n")
+
+    def close_access_log(self):
+        """Close the access log, e.g. to finish writing a StreamAccessLog"""
+        self._access_log.close()
 
     def dump_access_log(self):
+        entries = list(self._access_log.entries(self._access_log.first))
         return '\n'.join(
             ' '.join(entry.access_type + f"{entry.block_index:<4x}".upper() + (f":{entry.block_type}" if entry.block_type else "")
-                     for entry in self._access_log[k:k+12])
-             for k in range(0, len(self._access_log), 12)
+                     for entry in entries[k:k+12])
+             for k in range(0, len(entries), 12)
         )
 
     def read_typed_block(self, block_index: int, factory: Type[BlockT], unsafe: bool=False) -> BlockT:
-        return factory.unpack(self.read_block(block_index, unsafe, block_type=factory.__name__))
+        if not self.cache_size:
+            return factory.unpack(self.read_block_view(block_index, unsafe, block_type=factory.__name__))
+
+        key = (block_index, factory)
+        blk = self._cache.get(key)
+        if blk is None:
+            self.cache_misses += 1
+            blk = factory.unpack(self.read_block_view(block_index, unsafe, block_type=factory.__name__))
+            self._cache[key] = blk
+            self._cache_factories.add(factory)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            # a cache hit is still a logical read of the block
+            assert unsafe or not self.free_map[block_index], f"read_typed_block({block_index}) on free block"
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+            self._access_log.append('r', block_index, factory.__name__)
+        return cast(BlockT, blk)
 
     def read_block(self, block_index: int, unsafe: bool=False, block_type: str='') -> bytes:
-        assert unsafe or not self.free_map[block_index], f"read_block({block_index}) on free block"
-        self._access_log.append(AccessLogEntry('r', block_index, block_type))
+        return bytes(self.read_block_view(block_index, unsafe, block_type))
+
+    def read_block_view(self, block_index: int, unsafe: bool=False, block_type: str='') -> memoryview:
+        """
+        Read a block as a zero-copy view of the device.
+        The view is only valid until the block is next written,
+        so callers should decode or copy it rather than keep it.
+        """
+        return self.read_blocks_view(block_index, 1, unsafe, block_type)
+
+    def read_blocks_view(self, block_index: int, count: int, unsafe: bool=False, block_type: str='') -> memoryview:
+        """Read count consecutive blocks as a single zero-copy view, cf. read_block_view"""
+        end = block_index + count
+        assert unsafe or not self.free_map[block_index:end].any(), \
+            f"read_blocks_view({block_index}, {count}) includes free block"
+        for i in range(block_index, end):
+            self._access_log.append('r', i, block_type)
         start = block_index * block_size + self.skip
-        return self.mm[start:start+block_size]
+        return self.storage.view(start, count*block_size)
 
     def write_typed_block(self, block_index: int, block: AbstractBlock):
         self.write_block(block_index, block.pack(), block_type=type(block).__name__)
 
     def write_block(self, block_index: int, data: bytes, block_type: str=''):
-        self.free_map[block_index] = False
-        self._access_log.append(AccessLogEntry('w', block_index, block_type))
+        self.allocator.mark_used(block_index)
+        # the new data mustn't be zeroed on reuse or discarded
+        self._unzeroed.discard(block_index)
+        self._cache_invalidate(block_index)
+        self._access_log.append('w', block_index, block_type)
         start = block_index*block_size + self.skip
-        self.mm[start:start+block_size] = data
+        self.storage.write(start, data)
 
     def allocate_block(self) -> int:
-        block_index = self._next_free_block()
-        assert block_index is not None, "allocate_block: Device full!"
-        self.free_map[block_index] = False
-        self._access_log.append(AccessLogEntry('a', block_index, ''))
-        return block_index
+        return self.allocate_blocks(1)[0]
+
+    def allocate_blocks(self, count: int) -> list[int]:
+        """Allocate the lowest count free blocks in a single search"""
+        blocks = self.allocator.allocate(count)
+        for block_index in blocks:
+            self._access_log.append('a', block_index)
+        if self._unzeroed:
+            self._zero_reused(blocks)
+        return blocks
+
+    def allocate_extent(self, count: int) -> list[int]:
+        """Allocate count blocks, contiguous if the free map allows"""
+        blocks = self.allocator.allocate_extent(count)
+        for block_index in blocks:
+            self._access_log.append('a', block_index)
+        if self._unzeroed:
+            self._zero_reused(blocks)
+        return blocks
+
+    def release_blocks(self, blocks: Iterable[int]):
+        """Return allocated blocks which were never written to the free map, without zeroing them"""
+        for block_index in blocks:
+            assert not self.free_map[block_index], f"release_blocks({block_index}): already free"
+            self.allocator.mark_free(block_index)
+            self._access_log.append('f', block_index)
 
     def free_block(self, block_index: int):
         assert not self.free_map[block_index], f"free_block({block_index}): already free"
-        self.write_block(block_index, bytes(block_size))
-        self.free_map[block_index] = True
-        self._access_log.append(AccessLogEntry('f', block_index, ''))
+        match self.free_policy:
+            case FreePolicy.zero:
+                self.write_block(block_index, bytes(block_size))
+            case FreePolicy.reuse | FreePolicy.punch:
+                self._unzeroed.add(block_index)
+        self.allocator.mark_free(block_index)
+        self._cache_invalidate(block_index)
+        self._access_log.append('f', block_index)
 
     def reset_free_map(self, block_index: int):
         self.bit_map_pointer = block_index
-        k = block_size_bits + 3
-        for i in range(self.bitmap_blocks):
-            b = self.read_typed_block(i + block_index, BitmapBlock, unsafe=True)
-            self.free_map[i<<k : (i+1)<<k] = b.free_map
+        if self.mapped_free_map:
+            self._map_free_map()
+            self.allocator = BlockAllocator(self.free_map, self.total_blocks)
+        else:
+            k = block_size_bits + 3
+            for i in range(self.bitmap_blocks):
+                b = self.read_typed_block(i + block_index, BitmapBlock, unsafe=True)
+                self.free_map[i<<k : (i+1)<<k] = b.free_map
+            self.allocator.reset()
         logging.debug(f"Read {self.bitmap_blocks} bitmask blocks with {len(self.free_map)} bits covering {self.total_blocks} volume blocks")
         assert self.total_blocks <= len(self.free_map) < self.total_blocks + (block_size << 3), \
             f"reset_free_map: unexpected free_map length {len(self.free_map)} for {self.total_blocks} blocks"
-        if any(self.free_map[:block_index+self.bitmap_blocks]):
+        if self.free_map[:block_index+self.bitmap_blocks].any():
             logging.warning("bitmap shows free space in volume prologue")
-        if any(self.free_map[self.total_blocks:]):
+        if self.free_map[self.total_blocks:].any():
             logging.warning("bitmap shows free space past end of volume")
 
+    def restore_free_map(self, free_map: bitarray):
+        """Roll the free map back to an earlier copy, e.g. to abandon a failed transaction"""
+        self.free_map[:] = free_map
+        # blocks in use again mustn't be zeroed on reuse or discarded
+        self._unzeroed = {i for i in self._unzeroed if free_map[i]}
+        self.allocator.reset()
+        self.allocator.mark_all_dirty()
+
     def write_free_map(self):
+        """Write the bitmap blocks which changed since the free map was last read or written"""
         assert self.bit_map_pointer is not None, "Device bit_map_pointer not set"
-        start = self.bit_map_pointer
-        self.free_map[start:start+self.bitmap_blocks] = False    # mark self used
+        for i in range(self.bit_map_pointer, self.bit_map_pointer + self.bitmap_blocks):
+            self.allocator.mark_used(i)     # mark self used
+        if self.mapped_free_map:
+            # changes are already in place, but drop any stale decoded copies
+            for i in self.allocator.dirty:
+                self._cache_invalidate(i + self.bit_map_pointer)
+            self.allocator.dirty.clear()
+            return
         bits_per_block = 1 << (block_size_bits + 3)
-        for i in range(self.bitmap_blocks):
+        dirty = self.allocator.dirty
+        for i in sorted(dirty):
             start = i*bits_per_block
             blk = BitmapBlock(free_map=self.free_map[start:start+bits_per_block])
             self.write_typed_block(i + self.bit_map_pointer, blk)
+        dirty.clear()
+
+    def _zero_reused(self, blocks: list[int]):
+        for block_index in blocks:
+            if block_index in self._unzeroed:
+                self._unzeroed.remove(block_index)
+                self.write_block(block_index, bytes(block_size))
+
+    def _discard_freed(self):
+        """Zero freed blocks a run at a time, letting the storage punch host holes"""
+        blocks = sorted(self._unzeroed)
+        self._unzeroed.clear()
+        start = 0
+        for i in range(1, len(blocks) + 1):
+            if i == len(blocks) or blocks[i] != blocks[i-1] + 1:
+                self.storage.discard(blocks[start] * block_size + self.skip, (i - start) * block_size)
+                start = i
+
+    def _map_free_map(self):
+        assert self.bit_map_pointer is not None, "Device bit_map_pointer not set"
+        buffer = self.storage.buffer()
+        assert buffer is not None, f"BlockDevice: {type(self.storage).__name__} can't map the free map"
+        start = self.bit_map_pointer * block_size + self.skip
+        view = buffer[start:start + self.bitmap_blocks * block_size]
+        # ProDOS bitmaps are big-endian, block 0 in bit 7 of the first byte
+        self.free_map = bitarray(buffer=view, endian='big')
 
     def _next_free_block(self) -> Optional[int]:
-        return next(
-            (i for (i, free) in enumerate(self.free_map) if free),
-            None
-        )
\ No newline at end of file
+        return self.allocator.next_free()
+
+
+def _preallocate(f: BinaryIO, size: int):
+    """Reserve host space for a whole file, falling back to writing zeros"""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+    # write zeros after the prefix in chunks rather than building the whole image
+    chunk = bytes(1 << 16)
+    pos = f.tell()
+    while pos < size:
+        pos += f.write(chunk[:min(len(chunk), size - pos)])
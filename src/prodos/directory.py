@@ -1,20 +1,36 @@
 import logging
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from fnmatch import fnmatch
-from typing import Optional, cast
+from typing import Iterator, Optional, Self
 
 from .blocks import DirectoryBlock
 from .device import BlockDevice
 from .file import FileBase, PlainFile
-from .globals import block_size, entries_per_block
+from .globals import block_size, entries_per_block, entry_length
 from .metadata import (
     DirectoryEntry,
     DirectoryHeaderEntry,
     FileEntry,
+    NamedEntry,
     StorageType,
     SubdirectoryHeaderEntry,
     VolumeDirectoryHeaderEntry
 )
+from .pathglob import PathPattern, is_wildcard
+from .stream import FileWriter
+
+
+def patch_entry(device: BlockDevice, block_index: int, slot: int, entry: NamedEntry):
+    """
+    Re-pack a single entry in place within a directory block, without decoding the rest,
+    where slot 0 is the first entry after the prev/next pointers, i.e. the header of a key block.
+    """
+    assert 0 <= slot < entries_per_block, f"patch_entry: bad slot {slot}"
+    data = bytearray(device.read_block_view(block_index))
+    offset = DirectoryBlock.SIZE + slot * entry_length
+    data[offset:offset + entry_length] = entry.pack()
+    device.write_block(block_index, bytes(data), block_type=DirectoryBlock.__name__)
 
 
 @dataclass(kw_only=True)
@@ -44,6 +60,16 @@ class DirectoryFile(FileBase):
     """
     header: DirectoryHeaderEntry
     entries: list[FileEntry] = field(default_factory=list[FileEntry])
+    # lazily built name -> slot and key_pointer -> slot indexes of active entries, see _slots
+    _names: Optional[dict[str, int]] = field(default=None, init=False, repr=False, compare=False)
+    _keys: Optional[dict[int, int]] = field(default=None, init=False, repr=False, compare=False)
+    # indexes into block_list of blocks with changed entries, or None to write them all
+    _dirty: Optional[set[int]] = field(default=None, init=False, repr=False, compare=False)
+    # nesting depth of batch(), and whether a write was deferred
+    _batch: int = field(default=0, init=False, repr=False, compare=False)
+    _pending: bool = field(default=False, init=False, repr=False, compare=False)
+    # shared cache this directory was read through, if any, see DirectoryCache
+    dcache: Optional["DirectoryCache"] = field(default=None, repr=False, compare=False)
 
     def __repr__(self):
         s = '\n'.join([repr(e) for e in self.entries if e.is_active])
@@ -80,27 +106,71 @@ class DirectoryFile(FileBase):
         return entries[0] if entries else None
 
     def glob_file(self, pattern: str) -> list[FileEntry]:
+        pattern = pattern.upper()
+        if not is_wildcard(pattern):
+            i = self.name_slot(pattern)
+            return [] if i is None else [self.entries[i]]
         return [
-            e for e in self.entries if e.is_active and fnmatch(e.file_name, pattern.upper())
+            e for e in self.entries if e.is_active and fnmatch(e.file_name, pattern)
         ]
 
-    def glob_path(self, parts: list[str]) -> list[FileEntry]:
-        pattern = parts.pop(0)
-
-        entries = self.glob_file(pattern)
-
-        if not parts:
-            return entries
+    def name_slot(self, name: str) -> Optional[int]:
+        """Find the slot of the active entry with this (upper case) name"""
+        names, _ = self._slots()
+        i = names.get(name)
+        # renaming an entry in place can leave a stale name behind
+        if i is not None and self.entries[i].is_active and self.entries[i].file_name == name:
+            return i
+        return None
+
+    def entry_slot(self, entry: FileEntry) -> Optional[int]:
+        """Find the slot of an entry, looking it up by key pointer"""
+        _, keys = self._slots()
+        i = keys.get(entry.key_pointer)
+        if i is not None and self.entries[i] == entry:
+            return i
+        return next((i for i, e in enumerate(self.entries) if e == entry), None)
+
+    def _slots(self) -> tuple[dict[str, int], dict[int, int]]:
+        if self._names is None or self._keys is None:
+            active = [(i, e) for i, e in enumerate(self.entries) if e.is_active]
+            self._names = {e.file_name: i for i, e in active}
+            self._keys = {e.key_pointer: i for i, e in active}
+        return self._names, self._keys
+
+    @staticmethod
+    def slot_block(i: int) -> int:
+        """Index in block_list of the block holding entry slot i, given the header leads the key block"""
+        return (i + 1) // entries_per_block
+
+    def _set_entry(self, i: int, entry: FileEntry):
+        """Update a slot, marking its block dirty and keeping the slot indexes current"""
+        old = self.entries[i]
+        self.entries[i] = entry
+        if self._dirty is not None:
+            self._dirty.add(self.slot_block(i))
+        if self._names is None or self._keys is None:
+            return
+        if old.is_active:
+            if self._names.get(old.file_name) == i:
+                del self._names[old.file_name]
+            if self._keys.get(old.key_pointer) == i:
+                del self._keys[old.key_pointer]
+        if entry.is_active:
+            self._names[entry.file_name] = i
+            self._keys[entry.key_pointer] = i
 
-        return sum(
-            (
-                DirectoryFile.read(self.device, e.key_pointer).glob_path(parts)
-                for e in entries
-                if e.is_dir
-            ),
-            cast(list[FileEntry], [])
+    def glob_path(self, parts: list[str]) -> list[FileEntry]:
+        return PathPattern.compile([parts]).glob(
+            self, lambda e: self.read_subdirectory(e.key_pointer)
         )
 
+    def read_subdirectory(self, block_index: int) -> "DirectoryFile":
+        """Read another directory, via our cache if we have one"""
+        if self.dcache:
+            return self.dcache.read(self.device, block_index)
+        return DirectoryFile.read(self.device, block_index)
+
     def free_entry(self) -> int:
         i = next((i for i, e in enumerate(self.entries) if not e.is_active), None)
         if i is None:
@@ -109,24 +179,51 @@ class DirectoryFile(FileBase):
         return i
 
     def write_entry(self, i: int, entry: FileEntry):
-        self.entries[i] = entry
+        self._set_entry(i, entry)
         self.write()
 
+    def update_entry(self, i: int, entry: FileEntry):
+        """
+        Rewrite a single entry in place, e.g. after a rename, where the file count doesn't change.
+        This patches just the block holding the entry, unless writes are being deferred.
+        """
+        self._set_entry(i, entry)
+        if self._dirty is None or self._deferred():
+            self.write()
+            return
+        b = self.slot_block(i)
+        patch_entry(self.device, self.block_list[b], (i + 1) % entries_per_block, entry)
+        self._dirty.discard(b)
+        if self.dcache:
+            self.dcache.paths.clear()
+
     def add_entry(self, entry: FileEntry):
         self.write_entry(self.free_entry(), entry)
 
     def remove_entry(self, entry: FileEntry):
         #TODO do we need to test for directory?
-        i = next((i for i, e in enumerate(self.entries) if e == entry), None)
+        i = self.entry_slot(entry)
         assert i is not None, f"Directory.remove_entry {entry} not found in {self}"
-        self.entries[i] = FileEntry.empty
+        self._set_entry(i, FileEntry.empty)
         self.write()
 
     def remove_simple_file(self, entry: FileEntry):
         assert entry.is_plain_file, f"Directory.remove_simple_file: not simple file {entry}"
         self.remove_entry(entry)
-        f = PlainFile.from_entry(self.device, entry)
-        f.remove()
+        # only the index blocks need reading to find the blocks to free
+        self._free_blocks(PlainFile.block_list_from_entry(self.device, entry))
+
+    def _free_blocks(self, blocks: list[int]):
+        """
+        Free blocks no longer used by an entry.  In a Volume.transaction they're
+        freed on commit, so a rollback doesn't leave restored entries pointing
+        at freed, zeroed or reused blocks.
+        """
+        if self.dcache and self.dcache.batch:
+            self.dcache.freed += blocks
+        else:
+            for block_index in blocks:
+                self.device.free_block(block_index)
 
     def add_simple_file(self, f: PlainFile):
         entries = self.glob_file(f.file_name)
@@ -136,6 +233,23 @@ class DirectoryFile(FileBase):
         f.write()
         self.add_entry(f.entry(self.block_list[0]))
 
+    def create_file(self, file_name: str) -> FileWriter:
+        """
+        Open a writable stream for a new simple file, which is added to this directory
+        on close, replacing any existing simple file with the same name.
+        """
+        existing = self.file_entry(file_name)
+        if existing and not existing.is_plain_file:
+            raise ValueError(f"Destination {file_name} exists and is not a simple file")
+
+        def add_entry(entry: FileEntry):
+            existing = self.file_entry(file_name)
+            if existing:
+                self.remove_simple_file(existing)
+            self.add_entry(entry)
+
+        return FileWriter(self.device, file_name, header_pointer=self.block_list[0], on_close=add_entry)
+
     def move_simple_file(self, entry: FileEntry, dest_dir: "DirectoryFile", dest_name: str):
         """Move a simple file from this directory to another directory with a new name."""
         assert entry.is_plain_file, f"Directory.move_simple_file: not simple file {entry}"
@@ -152,10 +266,10 @@ class DirectoryFile(FileBase):
 
         # If moving within same directory (rename), update in place
         if same_dir:
-            idx = next((i for i, e in enumerate(self.entries) if e == entry), None)
+            idx = self.entry_slot(entry)
             assert idx is not None, f"Directory.move_simple_file: entry not found"
             entry.file_name = dest_name
-            self.write_entry(idx, entry)
+            self.update_entry(idx, entry)
         else:
             # Remove from source directory
             self.remove_entry(entry)
@@ -169,7 +283,7 @@ class DirectoryFile(FileBase):
 
     def remove_directory(self, entry: FileEntry):
         assert entry.is_dir, f"Directory.remove_directory: not directory {entry}"
-        dir = self.read(self.device, entry.key_pointer)
+        dir = self.read_subdirectory(entry.key_pointer)
         assert dir.is_empty, f"Directory.remove_directory: directory not empty {entry}"
         self.remove_entry(entry)
         dir.remove()
@@ -189,9 +303,12 @@ class DirectoryFile(FileBase):
                 parent_entry_number=i
             ),
             file_name=file_name,  #TODO can we avoid duplication from header
-            entries=[]
+            entries=[],
+            dcache=self.dcache,
         )
         subdir.write()
+        if self.dcache:
+            self.dcache.add(subdir)
 
         entry = subdir.entry(self.block_list[0])
         self.write_entry(i, entry)
@@ -212,10 +329,10 @@ class DirectoryFile(FileBase):
 
         # If moving within same directory (rename), update in place
         if same_dir:
-            idx = next((i for i, e in enumerate(self.entries) if e == entry), None)
+            idx = self.entry_slot(entry)
             assert idx is not None, f"Directory.move_directory: entry not found"
             entry.file_name = dest_name
-            self.write_entry(idx, entry)
+            self.update_entry(idx, entry)
         else:
             # Remove from source directory
             self.remove_entry(entry)
@@ -228,60 +345,144 @@ class DirectoryFile(FileBase):
             idx = dest_dir.free_entry()
             dest_dir.write_entry(idx, entry)
 
-            # Update subdirectory header with new parent information
-            sub_dir = self.read(self.device, entry.key_pointer)
-            assert isinstance(sub_dir.header, SubdirectoryHeaderEntry), \
-                f"Directory.move_directory: expected SubdirectoryHeaderEntry, got {type(sub_dir.header)}"
-            sub_dir.header.parent_pointer = dest_dir.block_list[0]
-            sub_dir.header.parent_entry_number = idx
-            sub_dir.write(compact=False)
+        # Update subdirectory header with its new name and parent information
+        self._patch_subdirectory_header(entry.key_pointer, dest_name, dest_dir.block_list[0], idx)
+
+    def _patch_subdirectory_header(self, block_index: int, file_name: str, parent_pointer: int, parent_entry_number: int):
+        """Update a subdirectory's header in place in its key block, without reading the whole directory"""
+        if self.dcache and self._deferred():
+            # batched, so the header is written with the rest of the changes, or not at all
+            d = self.dcache.read(self.device, block_index)
+            assert isinstance(d.header, SubdirectoryHeaderEntry), \
+                f"Directory.move_directory: expected SubdirectoryHeaderEntry, got {type(d.header)}"
+            d.file_name = d.header.file_name = file_name
+            d.header.parent_pointer = parent_pointer
+            d.header.parent_entry_number = parent_entry_number
+            if d._dirty is not None:
+                d._dirty.add(0)
+            d.write()
+            return
+        cached = self.dcache.directories.get(block_index) if self.dcache else None
+        header = cached.header if cached else self.device.read_typed_block(block_index, DirectoryBlock).header_entry
+        assert isinstance(header, SubdirectoryHeaderEntry), \
+            f"Directory.move_directory: expected SubdirectoryHeaderEntry, got {type(header)}"
+        header.file_name = file_name
+        header.parent_pointer = parent_pointer
+        header.parent_entry_number = parent_entry_number
+        if cached:
+            cached.file_name = file_name
+        patch_entry(self.device, block_index, 0, header)
 
     def remove(self):
         assert self.is_empty, f"Directory.remove: directory not empty {self}"
-        super().remove()
-
-    def write(self, compact: bool=True):
+        if self.dcache:
+            self.dcache.discard(self.block_list[0])
+        self._free_blocks(self.block_list)
+        self.block_list = []
+
+    def write(self):
+        """
+        Write the key block, with its header and file count, and any blocks with changed entries,
+        allocating blocks for new entries as needed.  Empty slots are left in place
+        for reuse, see compact.
+        """
         assert (len(self.entries) + 1) % entries_per_block == 0, \
             f"Directory: header plus {len(self.entries)} entries isn't a multiple of {entries_per_block}"
 
-        # root directory is fixed size
-        if compact and not isinstance(self.header, VolumeDirectoryHeaderEntry):
-            # keep all non-empty entries in the same order
-            self.entries = [ e for e in self.entries if e != FileEntry.empty]
-            self.pad_entries()
+        if self.dcache:
+            # entries may have been added, renamed or removed
+            self.dcache.paths.clear()
+
+        # a new directory is written straight away so it has a key block
+        if self._dirty is not None and self._deferred():
+            self._pending = True
+            return
 
         n = (len(self.entries) + 1) // entries_per_block
         while len(self.block_list) > n:
             self.device.free_block(self.block_list.pop())
+            if self._dirty is not None:
+                # new last block needs a nil next_pointer
+                self._dirty.add(len(self.block_list) - 1)
         while len(self.block_list) < n:
+            if self._dirty is not None:
+                # new block, and its predecessor's next_pointer
+                self._dirty.update((len(self.block_list) - 1, len(self.block_list)))
             self.block_list.append(self.device.allocate_block())
 
         self.header.file_count = sum(e.is_active for e in self.entries)
-        offset = entries_per_block-1
-        key = DirectoryBlock(
-            prev_pointer=0, next_pointer=self.block_list[1] if n > 1 else 0,
-            header_entry=self.header,
-            file_entries=self.entries[:offset]
-        )
-        self.device.write_typed_block(self.block_list[0], key)
-        for i in range(1, n):
-            blk = DirectoryBlock(
-                prev_pointer=self.block_list[i-1],
-                next_pointer=self.block_list[i+1] if i+1 < n else 0,
-                file_entries=self.entries[offset:offset + entries_per_block]
+        dirty = range(n) if self._dirty is None else sorted(i for i in self._dirty | {0} if i < n)
+        for i in dirty:
+            self.device.write_typed_block(self.block_list[i], self._pack_block(i))
+        self._dirty = set()
+        self._pending = False
+
+    def _deferred(self) -> bool:
+        return bool(self._batch or (self.dcache and self.dcache.batch))
+
+    @contextmanager
+    def batch(self) -> Iterator[Self]:
+        """
+        Defer writes until the end of the with block,
+        so a series of entry changes writes each changed block once.
+        """
+        self._batch += 1
+        try:
+            yield self
+        finally:
+            self._batch -= 1
+            if not self._batch and self._pending:
+                self.write()
+
+    def compact(self):
+        """
+        Squeeze out empty slots, keeping entries in the same order, and free any trailing blocks
+        that are no longer needed.  This rewrites the whole directory so is best done once
+        after a batch of removals.  The volume directory is fixed size so is left alone.
+        """
+        if isinstance(self.header, VolumeDirectoryHeaderEntry):
+            return
+        active = [(i, e) for (i, e) in enumerate(self.entries) if e != FileEntry.empty]
+        self.entries = [e for (_, e) in active]
+        self.pad_entries()
+        # slots have moved, so every block needs writing, and any now past the end freeing
+        self._names = self._keys = None
+        if self._dirty is not None:
+            self._dirty.update(range(len(self.block_list)))
+        self.write()
+        # subdirectories record their slot in their parent
+        for j, (i, e) in enumerate(active):
+            if i != j and e.is_dir:
+                self._patch_subdirectory_header(e.key_pointer, e.file_name, self.block_list[0], j)
+
+    def _pack_block(self, i: int) -> DirectoryBlock:
+        n = len(self.block_list)
+        prev_pointer = self.block_list[i-1] if i > 0 else 0
+        next_pointer = self.block_list[i+1] if i+1 < n else 0
+        if i == 0:
+            return DirectoryBlock(
+                prev_pointer=prev_pointer, next_pointer=next_pointer,
+                header_entry=self.header,
+                file_entries=self.entries[:entries_per_block-1]
             )
-            offset += entries_per_block
-            self.device.write_typed_block(self.block_list[i], blk)
-        assert offset == len(self.entries), f"Directory.write: unexpected offset {offset} != {len(self.entries)}"
+        offset = i * entries_per_block - 1
+        return DirectoryBlock(
+            prev_pointer=prev_pointer, next_pointer=next_pointer,
+            file_entries=self.entries[offset:offset + entries_per_block]
+        )
 
     @classmethod
-    def read(cls, device: BlockDevice, block_index: int):
+    def read(cls, device: BlockDevice, block_index: int, dcache: Optional["DirectoryCache"]=None):
         entries: list[FileEntry] = []
+        block_list: list[int] = []
         prev = 0
-        mark = device.mark_session()
         header: Optional[DirectoryEntry] = None
         while True:
             db = device.read_typed_block(block_index, DirectoryBlock)
+            if device.cache_size:
+                # cached blocks are shared, but we change our header and entries in place
+                db = DirectoryBlock.unpack(db.pack())
+            block_list.append(block_index)
             if prev == 0:
                 assert db.header_entry, "Directory.read: Expected DirectoryHeaderEntry in key block"
                 header = db.header_entry
@@ -297,10 +498,57 @@ class DirectoryFile(FileBase):
             block_index = db.next_pointer
 
         assert header, "Directory.read: no header entry"
-        return cls(
+        directory = cls(
             device=device,
             header=header,
             entries=entries,
-            block_list=device.get_access_log('r', mark),
+            block_list=block_list,
             file_name=header.file_name,
+            dcache=dcache,
         )
+        # in sync with the device, so only changes need writing
+        directory._dirty = set()
+        return directory
+
+
+@dataclass
+class DirectoryCache:
+    """
+    Directories keyed by key block, plus resolved paths, shared by a Volume.
+
+    Everyone reading through the cache shares one DirectoryFile per directory,
+    so changes made through any of them are seen by all.  Any directory write
+    clears the resolved paths since entries may have been renamed, moved or removed.
+    Directories read or changed outside the cache aren't tracked.
+    """
+    directories: dict[int, DirectoryFile] = field(default_factory=dict[int, DirectoryFile])
+    paths: dict[str, FileEntry] = field(default_factory=dict[str, FileEntry])
+    batch: int = 0      # nesting depth of Volume.transaction, deferring directory writes
+    freed: list[int] = field(default_factory=list[int])     # blocks to free on commit
+
+    def read(self, device: BlockDevice, block_index: int) -> DirectoryFile:
+        d = self.directories.get(block_index)
+        if d is None:
+            d = self.directories[block_index] = DirectoryFile.read(device, block_index, dcache=self)
+        return d
+
+    def add(self, d: DirectoryFile):
+        self.directories[d.block_list[0]] = d
+
+    def discard(self, block_index: int):
+        self.directories.pop(block_index, None)
+        self.paths.clear()
+
+    def commit(self, device: BlockDevice):
+        """Write every directory with deferred changes, then free the blocks they no longer use"""
+        for d in self.directories.values():
+            if d._pending:
+                d.write()
+        for block_index in self.freed:
+            device.free_block(block_index)
+        self.freed.clear()
+
+    def clear(self):
+        self.directories.clear()
+        self.paths.clear()
+        self.freed.clear()
@@ -2,14 +2,17 @@ import logging
 import re
 import string
 from dataclasses import dataclass, field
-from typing import Self
+from typing import TYPE_CHECKING, Callable, Iterator, Self
 
 from .blocks import ExtendedKeyBlock, IndexBlock
 from .device import BlockDevice
-from .globals import block_size, block_size_bits
+from .globals import block_size, block_size_bits, is_zero
 from .metadata import FileEntry, StorageType, access_byte
 from .p8datetime import P8DateTime
 
+if TYPE_CHECKING:
+    from _typeshed import WriteableBuffer
+
 
 def legal_path(path: str) -> str:
     return '/'.join([
@@ -94,7 +97,7 @@ class PlainFile(FileBase):
                                          |
                           Bytes $565..$568
     """
-    data: bytes
+    data: bytes | bytearray
 
     @property
     def file_size(self) -> int:
@@ -113,7 +116,7 @@ class PlainFile(FileBase):
     def export(self, dst: str):
         open(dst, 'wb').write(self.data)
 
-    def write(self) -> int:
+    def write(self, contiguous: bool=True) -> int:
         """
         write to a hierarchical file, returning storage level.
         Sparse files are handled with blocks of zeros encoded with block index 0.
@@ -125,6 +128,11 @@ class PlainFile(FileBase):
             a data block to be read in when the file is opened.
 
         This is probably a consequence of the create/set eof api.
+
+        With contiguous=True we reserve a single extent for all the index and data
+        blocks up front, so the file is laid out sequentially on the volume
+        (falling back to first-fit if no free run is long enough).
+        Otherwise each block is allocated first-fit as we go.
         """
         if self.block_list:
             self.remove()
@@ -136,20 +144,37 @@ class PlainFile(FileBase):
             chunk_size <<= 8
             level += 1
 
-        self._write_simple_file(self.data, chunk_size)
+        alloc = self.device.allocate_block
+        if contiguous:
+            extent = self.device.allocate_extent(self._count_blocks(self.data, chunk_size))
+            alloc = iter(extent).__next__
+
+        self._write_simple_file(self.data, chunk_size, alloc)
 
         return level
 
-    def _write_simple_file(self, data: bytes, chunk_size: int) -> int:
+    @classmethod
+    def _count_blocks(cls, data: bytes | bytearray, chunk_size: int) -> int:
+        """Count the index and data blocks that _write_simple_file will allocate"""
+        if chunk_size == block_size:
+            return 1
+        chunk_size >>= 8
+        return 1 + sum(
+            cls._count_blocks(blk, chunk_size)
+            for off in range(0, len(data), chunk_size)
+            if not is_zero(blk := data[off:off+chunk_size])
+        )
+
+    def _write_simple_file(self, data: bytes | bytearray, chunk_size: int, alloc: Callable[[], int]) -> int:
         # allocate block before writing sub-chunks
-        index = self.device.allocate_block()
+        index = alloc()
         self.block_list.append(index)
 
         n = len(data)
         assert n <= chunk_size, f"_write_simple_file: size {n} exceeds chunk {chunk_size}"
         if chunk_size == block_size:
             # pad to full block and write raw data
-            out = data + bytes(block_size-n)
+            out = bytes(data) + bytes(block_size-n)
             self.device.write_block(index, out)
         else:
             chunk_size >>= 8
@@ -158,8 +183,8 @@ class PlainFile(FileBase):
                 blk = data[off:off+chunk_size]
                 # sparse file skips write of empty blocks
                 ixs.append(
-                    self._write_simple_file(blk, chunk_size)
-                    if any(blk)
+                    self._write_simple_file(blk, chunk_size, alloc)
+                    if not is_zero(blk)
                     else 0
                 )
             self.device.write_typed_block(index, IndexBlock(block_pointers=ixs))
@@ -168,50 +193,171 @@ class PlainFile(FileBase):
     @classmethod
     def from_entry(cls, device: BlockDevice, entry: FileEntry) -> Self:
         assert entry.is_plain_file, f"File.from_entry: not simple file {entry}"
-        mark = device.mark_session()
-        data = cls._read_simple_file(
-            device,
-            block_index=entry.key_pointer,
-            level=entry.storage_type,
-            length=entry.eof
-        )
+        block_list: list[int] = []
+        data = cls.read_data(device, entry, block_list)
         return cls(
             device=device,
             file_name=entry.file_name,
             file_type=entry.file_type,
             data=data,
-            block_list=device.get_access_log('r', mark)
+            block_list=block_list
         )
 
     @classmethod
-    def _read_simple_file(cls, device: BlockDevice, block_index: int, level: int, length: int) -> bytes:
+    def block_list_from_entry(cls, device: BlockDevice, entry: FileEntry) -> list[int]:
+        """List the blocks used by a simple file, key block first, without reading its data"""
+        return [block_index for (block_index, _) in cls.walk_blocks(device, entry)]
+
+    @classmethod
+    def walk_blocks(cls, device: BlockDevice, entry: FileEntry) -> Iterator[tuple[int, str]]:
+        """
+        Generate (block_index, block_type) for each block of a simple file
+        in the same order that _read_simple_file reads them,
+        where block_type is 'IndexBlock' for key and index blocks or '' for data blocks.
+        Only index blocks are read, so this is cheap even for large files.
+        """
+        assert entry.is_plain_file, f"File.walk_blocks: not simple file {entry}"
+        for (block_index, block_type, _, _) in cls._walk_simple_file(device, entry.key_pointer, entry.storage_type, 0, entry.eof):
+            yield (block_index, block_type)
+
+    @classmethod
+    def data_extents(cls, device: BlockDevice, entry: FileEntry) -> Iterator[tuple[int, int, int]]:
+        """
+        Generate (offset, block_index, length) for each allocated data block of a simple file,
+        in file order, skipping sparse holes.  Data blocks themselves aren't read.
+        """
+        assert entry.is_plain_file, f"File.data_extents: not simple file {entry}"
+        for (block_index, block_type, offset, length) in cls._walk_simple_file(device, entry.key_pointer, entry.storage_type, 0, entry.eof):
+            if not block_type:
+                yield (offset, block_index, length)
+
+    @classmethod
+    def _walk_simple_file(cls, device: BlockDevice, block_index: int, level: int, offset: int, length: int) -> Iterator[tuple[int, str, int, int]]:
+        # mirrors _read_simple_file, visiting only pointers below length
+        if block_index == 0:
+            return
+        assert block_index < device.total_blocks, \
+            f"_walk_simple_file: block {block_index} beyond end of device"
+        if level == 1:
+            yield (block_index, '', offset, length)
+            return
+
+        yield (block_index, IndexBlock.__name__, offset, length)
+        idx = device.read_typed_block(block_index, IndexBlock)
+        chunk_bits = block_size_bits + ((level-2) << 3)
+        chunk_size = 1 << chunk_bits
+        n = ((length-1) >> chunk_bits) + 1
+        for j in range(0, n):
+            yield from cls._walk_simple_file(
+                device,
+                block_index=idx.block_pointers[j],
+                level=level-1,
+                offset=offset + j*chunk_size,
+                length=min(length - j*chunk_size, chunk_size)
+            )
+
+    @classmethod
+    def export_entry(cls, device: BlockDevice, entry: FileEntry, dst: str):
+        """
+        Export a simple file to the host without reading it into memory.
+        We seek over sparse holes rather than writing zeros,
+        so the host file is sparse too where the host file system supports it.
+        """
+        with open(dst, 'wb') as f:
+            for (offset, block_index, length) in cls.data_extents(device, entry):
+                f.seek(offset)
+                f.write(device.read_block_view(block_index)[:length])
+            # a trailing hole still counts towards the file size
+            f.truncate(entry.eof)
+
+    @classmethod
+    def read_data(cls, device: BlockDevice, entry: FileEntry, block_list: list[int] | None=None) -> bytes | bytearray:
+        """Read the contents of a simple file, see read_into for block_list"""
+        if entry.storage_type == StorageType.seedling:
+            if block_list is not None:
+                block_list.append(entry.key_pointer)
+            # a single block is quicker to copy than to set up a buffer for
+            return bytes(device.read_block_view(entry.key_pointer)[:entry.eof])
+        data = bytearray(entry.eof)
+        cls.read_into(device, entry, data, zeroed=True, block_list=block_list)
+        return data
+
+    @classmethod
+    def read_into(cls, device: BlockDevice, entry: FileEntry, buffer: "WriteableBuffer", zeroed: bool=False,
+            block_list: list[int] | None=None) -> int:
+        """
+        Read a simple file into the first eof bytes of buffer, returning eof.
+        Data blocks are copied straight from the device into place,
+        and sparse holes are zero filled unless the caller says the buffer is already zeroed,
+        e.g. a fresh bytearray(eof).
+        If given a block_list, the blocks read are appended to it in the order of
+        block_list_from_entry, saving a second pass over the index blocks.
+        """
+        assert entry.is_plain_file, f"File.read_into: not simple file {entry}"
+        out = memoryview(buffer).cast('B')
+        assert len(out) >= entry.eof, f"File.read_into: buffer size {len(out)} less than eof {entry.eof}"
+        if entry.storage_type == StorageType.seedling:
+            # a seedling's key block is its only data block
+            if block_list is not None:
+                block_list.append(entry.key_pointer)
+            out[:entry.eof] = device.read_block_view(entry.key_pointer)[:entry.eof]
+            return entry.eof
+        cls._read_simple_file(device, entry.key_pointer, entry.storage_type, out[:entry.eof], zeroed, block_list)
+        return entry.eof
+
+    @classmethod
+    def _read_simple_file(cls, device: BlockDevice, block_index: int, level: int, out: memoryview, zeroed: bool,
+            block_list: list[int] | None):
         assert level > 0, f"_read_simple_file: level {level} is not positive"
+        length = len(out)
         # Each level adds 8 bits to the addressable file length
         level_bits = block_size_bits + ((level-1) << 3)
         assert length <= (1 << level_bits), f"_read_simple_file: length {length} exceeds chunk {1 << level_bits}"
         if block_index == 0:
-            logging.debug("read_simple_file: sparse block")
-            return bytes([0]*length)
+            if not zeroed:
+                out[:] = bytes(length)
+            return
+        if block_list is not None:
+            block_list.append(block_index)
 
         if level == 1:
-            logging.debug(f"read_simple_file block {block_index} -> {length} bytes")
-            return device.read_block(block_index)[:length]
+            out[:] = device.read_block_view(block_index)[:length]
+            return
 
         idx = device.read_typed_block(block_index, IndexBlock)
         chunk_bits = level_bits - 8
         chunk_size = 1 << chunk_bits
         n = ((length-1) >> chunk_bits) + 1
+        ps = idx.block_pointers
+
+        if level == 2:
+            # copy each run of consecutive data blocks, or sparse holes, in one go
+            j = 0
+            while j < n:
+                p = ps[j]
+                k = j + 1
+                while k < n and ps[k] == (p and p + k - j):
+                    k += 1
+                start, end = j << block_size_bits, min(k << block_size_bits, length)
+                if p:
+                    out[start:end] = device.read_blocks_view(p, k - j)[:end - start]
+                    if block_list is not None:
+                        block_list.extend(range(p, p + k - j))
+                elif not zeroed:
+                    out[start:end] = bytes(end - start)
+                j = k
+            return
 
         logging.debug(f"read_simple_file: reading {n} chunks of size {chunk_size} for level {level}")
-        return b''.join(
+        for j in range(0, n):
             cls._read_simple_file(
                 device,
-                block_index=idx.block_pointers[j],
+                block_index=ps[j],
                 level=level-1,
-                length=min(length - j*chunk_size, chunk_size)
+                out=out[j*chunk_size:(j+1)*chunk_size],
+                zeroed=zeroed,
+                block_list=block_list,
             )
-            for j in range(0, n)
-        )
 
 
 @dataclass(kw_only=True)
@@ -245,6 +391,22 @@ class ExtendedFile(FileBase):
 #    def write(self) -> int:
 #        ...
 
+    @classmethod
+    def walk_blocks(cls, device: BlockDevice, entry: FileEntry) -> Iterator[tuple[int, str]]:
+        """
+        Generate (block_index, block_type) for the extended key block
+        followed by the blocks of each fork, cf. PlainFile.walk_blocks
+        """
+        assert entry.storage_type == StorageType.extended, \
+            f"ExtendedFile.walk_blocks: not extended file {entry}"
+        ext_block = device.read_typed_block(entry.key_pointer, ExtendedKeyBlock)
+        yield (entry.key_pointer, ExtendedKeyBlock.__name__)
+        for fork in (ext_block.data_fork, ext_block.resource_fork):
+            yield from PlainFile.walk_blocks(
+                device,
+                fork.as_file_entry(file_name=entry.file_name, file_type=entry.file_type)
+            )
+
     @classmethod
     def from_entry(cls, device: BlockDevice, entry: FileEntry) -> Self:
         """Read an extended file from a directory entry"""
@@ -1,4 +1,4 @@
-from typing import Final
+from typing import Final, TypeAlias
 
 # constants we can verify
 block_size_bits: Final          = 9
@@ -7,3 +7,13 @@ entry_length: Final             = 39
 entries_per_block: Final        = 13
 volume_key_block: Final         = 2
 volume_directory_length: Final  = 4     # not sure why this needs to be fixed
+
+# blocks and entries unpack from any of these, e.g. zero-copy views of the device
+ByteBuffer: TypeAlias = bytes | bytearray | memoryview
+
+
+def is_zero(buf: ByteBuffer) -> bool:
+    """Test for all zero bytes with a C level compare, much faster than not any(buf)"""
+    if isinstance(buf, memoryview):
+        buf = buf.tobytes()
+    return buf == bytes(len(buf))
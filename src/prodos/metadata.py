@@ -2,9 +2,10 @@ import logging
 import struct
 from dataclasses import dataclass, field, fields
 from enum import IntEnum
-from typing import Any, ClassVar, Final, Protocol, Self
+from typing import Any, Callable, ClassVar, Final, Protocol, Self
 
 from .globals import (
+    ByteBuffer,
     entries_per_block,
     entry_length,
     volume_directory_length,
@@ -72,6 +73,9 @@ simple_file_types = {
     StorageType.tree,
 }
 
+# every known storage type nibble, as plain ints for quick membership tests
+storage_types: Final = frozenset(map(int, StorageType))
+
 
 _access_flags: Final = dict(
     R = 1<<0,  # read
@@ -105,24 +109,24 @@ def shallow_dict(d: IsDataclass):
     return {f.name: getattr(d, f.name) for f in fields(d)}
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class NamedEntry:
     SIZE: ClassVar = 16
-    _struct: ClassVar = "<B15s"
+    _struct: ClassVar = struct.Struct("<B15s")
 
     storage_type: StorageType
     file_name: str
 
     def pack(self) -> bytes:
         type_len = (self.storage_type << 4) | len(self.file_name)
-        return struct.pack(NamedEntry._struct, type_len, self.file_name.encode('ascii'))
+        return NamedEntry._struct.pack(type_len, self.file_name.encode('ascii'))
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         (
             type_len,
             name,
-        ) = struct.unpack(cls._struct, buf)
+        ) = cls._struct.unpack(buf)
         storage_type = (type_len >> 4) & 0b1111
         name = name[:type_len & 0b1111]
         file_name = name.decode('ascii', errors='ignore')
@@ -132,11 +136,11 @@ class NamedEntry:
         )
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class DirectoryEntry(NamedEntry):
     """Entry pointing to a DirectoryFile within a directory block"""
     SIZE: ClassVar = NamedEntry.SIZE + 19
-    _struct: ClassVar = "<8s4s5BH"
+    _struct: ClassVar = struct.Struct("<8s4s5BH")
 
     #TODO/NOTE
     # spec suggests there are magic bytes for VolumeDirectoryHeaderEntry
@@ -166,8 +170,8 @@ class DirectoryEntry(NamedEntry):
             f"DirectoryHeaderEntry: entries_per_block {self.entries_per_block} != {entries_per_block}"
 
     def pack(self) -> bytes:
-        return super().pack() + struct.pack(
-            DirectoryEntry._struct,
+        # slotted dataclasses can't use zero argument super()
+        return NamedEntry.pack(self) + DirectoryEntry._struct.pack(
             self.reserved,
             self.created.pack(),
             self.version,
@@ -179,7 +183,7 @@ class DirectoryEntry(NamedEntry):
         )
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         n = NamedEntry.SIZE
         d = NamedEntry.unpack(buf[:n])
         (
@@ -191,7 +195,7 @@ class DirectoryEntry(NamedEntry):
             entry_length,
             entries_per_block,
             file_count
-        ) = struct.unpack(cls._struct, buf[n:])
+        ) = DirectoryEntry._struct.unpack(buf[n:])
         return cls(
             reserved=reserved,
             created=P8DateTime.unpack(dt),
@@ -205,7 +209,7 @@ class DirectoryEntry(NamedEntry):
         )
 
 
-@dataclass(kw_only=True, repr=False)
+@dataclass(kw_only=True, repr=False, slots=True)
 class VolumeDirectoryHeaderEntry(DirectoryEntry):
     """
     This is the first (header) entry in the volume directory,
@@ -255,20 +259,19 @@ class VolumeDirectoryHeaderEntry(DirectoryEntry):
           +----------------------------+
     """
     SIZE: ClassVar = DirectoryEntry.SIZE + 4
-    _struct: ClassVar = "<HH"
+    _struct: ClassVar = struct.Struct("<HH")
 
     bitmap_pointer: int        # first block of free map
     total_blocks: int           # total blocks on device
 
     def pack(self) -> bytes:
-        return super().pack() + struct.pack(
-            VolumeDirectoryHeaderEntry._struct,
+        return DirectoryEntry.pack(self) + VolumeDirectoryHeaderEntry._struct.pack(
             self.bitmap_pointer,
             self.total_blocks,
         )
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         n = DirectoryEntry.SIZE
         d = DirectoryEntry.unpack(buf[:n])
         assert d.storage_type == StorageType.voldirhdr, \
@@ -276,7 +279,7 @@ class VolumeDirectoryHeaderEntry(DirectoryEntry):
         (
             bitmap_pointer,
             total_blocks
-        ) = struct.unpack(cls._struct, buf[n:])
+        ) = cls._struct.unpack(buf[n:])
         return cls(
             bitmap_pointer=bitmap_pointer,
             total_blocks=total_blocks,
@@ -284,7 +287,7 @@ class VolumeDirectoryHeaderEntry(DirectoryEntry):
         )
 
 
-@dataclass(kw_only=True, repr=False)
+@dataclass(kw_only=True, repr=False, slots=True)
 class SubdirectoryHeaderEntry(DirectoryEntry):
     """
     This is the first (header) entry in each sub directory,
@@ -335,7 +338,7 @@ class SubdirectoryHeaderEntry(DirectoryEntry):
             +----------------------------+
     """
     SIZE: ClassVar = DirectoryEntry.SIZE + 4
-    _struct: ClassVar = "<HBB"
+    _struct: ClassVar = struct.Struct("<HBB")
 
     parent_pointer: int         # key block of parent dir
     parent_entry_number: int    # entry index in parent
@@ -346,15 +349,14 @@ class SubdirectoryHeaderEntry(DirectoryEntry):
             f"SubdirectoryHeaderEntry: unexpected parent_entry_length {self.parent_entry_length} != {entry_length}"
 
     def pack(self) -> bytes:
-        return super().pack() + struct.pack(
-            SubdirectoryHeaderEntry._struct,
+        return DirectoryEntry.pack(self) + SubdirectoryHeaderEntry._struct.pack(
             self.parent_pointer,
             self.parent_entry_number,
             self.parent_entry_length,
         )
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         n = DirectoryEntry.SIZE
         d = DirectoryEntry.unpack(buf[:n])
         assert d.storage_type == StorageType.subdirhdr, \
@@ -363,7 +365,7 @@ class SubdirectoryHeaderEntry(DirectoryEntry):
             parent_pointer,
             parent_entry_number,
             parent_entry_length
-        ) = struct.unpack(cls._struct, buf[n:])
+        ) = cls._struct.unpack(buf[n:])
         return cls(
             parent_pointer=parent_pointer,
             parent_entry_number=parent_entry_number,
@@ -375,7 +377,7 @@ class SubdirectoryHeaderEntry(DirectoryEntry):
 DirectoryHeaderEntry = VolumeDirectoryHeaderEntry | SubdirectoryHeaderEntry
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class FileEntry(NamedEntry):
     """
     Figure B-5. The File Entry
@@ -428,9 +430,10 @@ class FileEntry(NamedEntry):
 
     """
     SIZE: ClassVar = NamedEntry.SIZE + 23
-    _struct: ClassVar = "<BHHHB4sBBBH4sH"
+    _struct: ClassVar = struct.Struct("<BHHHB4sBBBH4sH")
     empty: ClassVar['FileEntry']
     root: ClassVar['FileEntry']
+    _slot_setters: ClassVar[tuple[Callable[[Any, Any], None], ...]]
 
     # match __repr__ layout
     heading: ClassVar = "File name               EOF T/FT Access Created        Modified      Blocks @ Key"
@@ -446,6 +449,8 @@ class FileEntry(NamedEntry):
     aux_type: int = 0
     last_mod: P8DateTime = field(default_factory=P8DateTime.now)
     header_pointer: int     # key block of directory owning this entry
+    # undecoded fields of a lazily unpacked entry, see unpack
+    _raw: bytes | None = field(default=None, init=False, repr=False, compare=False)
 
     def __repr__(self):
         typ = f"{self.storage_type:1x}/{self.file_type:02x}".upper()
@@ -471,8 +476,29 @@ class FileEntry(NamedEntry):
     def is_active(self) -> bool:
         return self.storage_type != 0
 
+    def __getattr__(self, name: str) -> Any:
+        # only called for unset slots, i.e. the undecoded fields of a lazy entry,
+        # or _raw itself while __init__ runs, which we set now to save further misses
+        if name == '_raw':
+            object.__setattr__(self, '_raw', None)
+            return None
+        raw = self._raw
+        if raw is None:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        self._decode(raw)
+        return getattr(self, name)
+
+    def __setattr__(self, name: str, value: Any):
+        # decode a lazy entry before changing it, so pack doesn't reuse stale bytes
+        raw = self._raw
+        if raw is not None and name != '_raw':
+            self._decode(raw)
+        object.__setattr__(self, name, value)
+
     def pack(self) -> bytes:
-        return super().pack() + struct.pack(FileEntry._struct,
+        if self._raw is not None:
+            return NamedEntry.pack(self) + self._raw
+        return NamedEntry.pack(self) + FileEntry._struct.pack(
             self.file_type,
             self.key_pointer,
             self.blocks_used,
@@ -488,13 +514,23 @@ class FileEntry(NamedEntry):
         )
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
-        n = NamedEntry.SIZE
-        d = NamedEntry.unpack(buf[:n])
-
-        if d.storage_type not in list(map(int, StorageType)):
-            logging.warning(f"FileEntry: unexpected storage type {d.storage_type:x}")
-
+    def unpack(cls, buf: ByteBuffer) -> Self:
+        """
+        Decode the storage type and name straight away, but leave the remaining fields
+        until first use, since directory scans mostly only look at names.
+        """
+        storage_type = buf[0] >> 4
+        if storage_type not in storage_types:
+            logging.warning(f"FileEntry: unexpected storage type {storage_type:x}")
+
+        entry = cls.__new__(cls)
+        init = object.__setattr__
+        init(entry, 'storage_type', storage_type)
+        init(entry, 'file_name', bytes(buf[1:1 + (buf[0] & 0b1111)]).decode('ascii', errors='ignore'))
+        init(entry, '_raw', bytes(buf[NamedEntry.SIZE:cls.SIZE]))
+        return entry
+
+    def _decode(self, raw: bytes):
         (
             file_type,
             key_pointer,
@@ -508,25 +544,39 @@ class FileEntry(NamedEntry):
             aux_type,
             mt,
             header_pointer,
-        ) = struct.unpack(cls._struct, buf[n:])
+        ) = FileEntry._struct.unpack(raw)
 
-        return cls(
-            file_type=file_type,
-            key_pointer=key_pointer,
-            blocks_used=blocks_used,
-            eof=eofw | (eof3 << 16),
-            created=P8DateTime.unpack(dt),
-            version=version,
-            min_version=min_version,
-            access=access,
-            aux_type=aux_type,
-            last_mod=P8DateTime.unpack(mt),
-            header_pointer=header_pointer,
-            **shallow_dict(d)
-        )
-
-
-@dataclass(kw_only=True)
+        # set the slots through their descriptors, which is quicker than
+        # object.__setattr__ since it skips the attribute lookup
+        (
+            set_file_type,
+            set_key_pointer,
+            set_blocks_used,
+            set_eof,
+            set_created,
+            set_version,
+            set_min_version,
+            set_access,
+            set_aux_type,
+            set_last_mod,
+            set_header_pointer,
+            set_raw,
+        ) = FileEntry._slot_setters
+        set_file_type(self, file_type)
+        set_key_pointer(self, key_pointer)
+        set_blocks_used(self, blocks_used)
+        set_eof(self, eofw | (eof3 << 16))
+        set_created(self, P8DateTime.unpack(dt))
+        set_version(self, version)
+        set_min_version(self, min_version)
+        set_access(self, access)
+        set_aux_type(self, aux_type)
+        set_last_mod(self, P8DateTime.unpack(mt))
+        set_header_pointer(self, header_pointer)
+        set_raw(self, None)
+
+
+@dataclass(kw_only=True, slots=True)
 class ExtendedForkEntry:
     """
     Mini-entry for data fork or resource fork in an extended file (storage type $5).
@@ -540,7 +590,7 @@ class ExtendedForkEntry:
     Followed by Finder info (36 bytes).
     """
     SIZE: ClassVar = 44  # 8 bytes mini-entry + 36 bytes finder info
-    _struct: ClassVar = "<BHHHB36s"
+    _struct: ClassVar = struct.Struct("<BHHHB36s")
 
     storage_type: StorageType
     key_block: int          # block address of fork's key block
@@ -551,8 +601,7 @@ class ExtendedForkEntry:
     def pack(self) -> bytes:
         assert len(self.finder_info) == 36, \
             f"ExtendedForkEntry.pack: finder_info should be 36 bytes, got {len(self.finder_info)}"
-        return struct.pack(
-            ExtendedForkEntry._struct,
+        return ExtendedForkEntry._struct.pack(
             self.storage_type,
             self.key_block,
             self.blocks_used,
@@ -562,7 +611,7 @@ class ExtendedForkEntry:
         )
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         (
             storage_type,
             key_block,
@@ -570,7 +619,7 @@ class ExtendedForkEntry:
             eofw,
             eof3,
             finder_info,
-        ) = struct.unpack(cls._struct, buf[:cls.SIZE])
+        ) = cls._struct.unpack(buf[:cls.SIZE])
 
         return cls(
             storage_type=storage_type,
@@ -599,6 +648,15 @@ class ExtendedForkEntry:
         )
 
 
+# in FileEntry._decode order, see there
+FileEntry._slot_setters = tuple(
+    FileEntry.__dict__[name].__set__
+    for name in (
+        'file_type', 'key_pointer', 'blocks_used', 'eof', 'created', 'version',
+        'min_version', 'access', 'aux_type', 'last_mod', 'header_pointer', '_raw',
+    )
+)
+
 # empty file entry to fill unused slots
 FileEntry.empty = FileEntry(
     storage_type = StorageType.empty,
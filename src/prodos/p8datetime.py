@@ -2,8 +2,10 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import ClassVar, Self
 
+from .globals import ByteBuffer
 
-@dataclass(kw_only=True, repr=False)
+
+@dataclass(kw_only=True, repr=False, slots=True)
 class P8DateTime:
     """
     Figure B-13. Date and Time Format
@@ -45,7 +47,7 @@ class P8DateTime:
         ])
 
     @classmethod
-    def unpack(cls, buf: bytes) -> Self:
+    def unpack(cls, buf: ByteBuffer) -> Self:
         return cls(
             year = buf[1] >> 1,
             month = (buf[0] >> 5) + ((buf[1] & 1) << 3),
@@ -0,0 +1,73 @@
+import re
+from dataclasses import dataclass, field
+from fnmatch import translate
+from typing import TYPE_CHECKING, Callable, Optional, Self
+
+from .metadata import FileEntry
+
+if TYPE_CHECKING:
+    from .directory import DirectoryFile
+
+
+def is_wildcard(pattern: str) -> bool:
+    """Does a file name pattern need fnmatch, or is it a literal name?"""
+    return any(c in pattern for c in '*?[')
+
+
+@dataclass
+class PathPattern:
+    """
+    Trie of upper case path components compiled from a set of path patterns.
+
+    Patterns which share a prefix share nodes, so globbing them together
+    reads each matching directory once.  Literal components are looked up
+    directly by name, and wildcards are compiled once via fnmatch.translate
+    rather than re-parsed for every entry.
+    """
+    terminal: bool = False      # a pattern ends at this node
+    match: Optional[Callable[[str], object]] = None     # None for a literal component
+    children: dict[str, Self] = field(default_factory=dict)
+
+    @classmethod
+    def compile(cls, patterns: list[list[str]]) -> Self:
+        """Compile patterns, each a list of path components"""
+        root = cls()
+        for parts in patterns:
+            node = root
+            for part in parts:
+                part = part.upper()
+                child = node.children.get(part)
+                if child is None:
+                    match = re.compile(translate(part)).match if is_wildcard(part) else None
+                    child = node.children[part] = cls(match=match)
+                node = child
+            node.terminal = True
+        return root
+
+    def glob(self, directory: "DirectoryFile", read_directory: Callable[[FileEntry], "DirectoryFile"]) -> list[FileEntry]:
+        """
+        Return the entries below directory matching any of the patterns,
+        each entry once, in pattern then directory order.
+        """
+        entries: list[FileEntry] = []
+        seen: set[int] = set()
+        subdirs: dict[int, "DirectoryFile"] = {}
+
+        def walk(directory: "DirectoryFile", node: PathPattern):
+            for part, child in node.children.items():
+                if child.match is None:
+                    i = directory.name_slot(part)
+                    matches = [] if i is None else [directory.entries[i]]
+                else:
+                    matches = [e for e in directory.entries if e.is_active and child.match(e.file_name)]
+                for e in matches:
+                    if child.terminal and id(e) not in seen:
+                        seen.add(id(e))
+                        entries.append(e)
+                    if child.children and e.is_dir:
+                        if e.key_pointer not in subdirs:
+                            subdirs[e.key_pointer] = read_directory(e)
+                        walk(subdirs[e.key_pointer], child)
+
+        walk(directory, self)
+        return entries
@@ -0,0 +1,173 @@
+import mmap
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal, Optional
+
+if TYPE_CHECKING:
+    from _typeshed import ReadableBuffer
+
+    from .device import DeviceMode
+
+# frees the host file's storage for pages of a shared mapping, i.e. punches a hole
+MADV_REMOVE: Optional[int] = getattr(mmap, 'MADV_REMOVE', None)
+
+StorageBackend = Literal['mmap', 'file', 'memory']
+
+
+class BlockStorage(ABC):
+    """
+    Byte addressed storage for a BlockDevice, usually a volume image file.
+
+    A view is zero-copy where the backend allows, so like BlockDevice.read_block_view
+    it's only valid until that range is next written.
+    """
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    @abstractmethod
+    def view(self, offset: int, length: int) -> memoryview: ...
+
+    @abstractmethod
+    def write(self, offset: int, data: "ReadableBuffer"): ...
+
+    def buffer(self) -> Optional[memoryview]:
+        """Writable view of the whole storage if it's addressable in memory, else None"""
+        return None
+
+    def discard(self, offset: int, length: int):
+        """Zero a range we no longer need, releasing its host storage if the backend can"""
+        self.write(offset, bytes(length))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MmapStorage(BlockStorage):
+    """Image file mapped into memory, the default"""
+    def __init__(self, path: Path, mode: "DeviceMode"='ro'):
+        with open(path, 'r+b' if mode == 'rw' else 'rb', buffering=0) as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if mode == 'rw' else mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self.mm)
+
+    def view(self, offset: int, length: int) -> memoryview:
+        return memoryview(self.mm)[offset:offset + length]
+
+    def write(self, offset: int, data: "ReadableBuffer"):
+        data = memoryview(data).cast('B')
+        self.mm[offset:offset + len(data)] = data
+
+    def buffer(self) -> Optional[memoryview]:
+        return memoryview(self.mm)
+
+    def discard(self, offset: int, length: int):
+        # punch out the whole pages in the range where the host supports it,
+        # and zero whatever is left
+        start = end = offset
+        lo = -(-offset // mmap.PAGESIZE) * mmap.PAGESIZE
+        hi = (offset + length) // mmap.PAGESIZE * mmap.PAGESIZE
+        if MADV_REMOVE is not None and lo < hi:
+            try:
+                self.mm.madvise(MADV_REMOVE, lo, hi - lo)
+                start, end = lo, hi
+            except OSError:
+                pass
+        self.write(offset, bytes(start - offset))
+        self.write(end, bytes(offset + length - end))
+
+    def flush(self):
+        self.mm.flush()
+
+
+class FileStorage(BlockStorage):
+    """
+    Image file accessed with positional os.pread/os.pwrite calls,
+    for file systems where mmap performs badly.  Views are copies.
+    """
+    def __init__(self, path: Path, mode: "DeviceMode"='ro'):
+        self.mode = mode
+        self.fd: Optional[int] = os.open(path, os.O_RDWR if mode == 'rw' else os.O_RDONLY)
+        self.size = os.fstat(self.fd).st_size
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def view(self, offset: int, length: int) -> memoryview:
+        assert self.fd is not None, "FileStorage: closed"
+        return memoryview(os.pread(self.fd, length, offset))
+
+    def write(self, offset: int, data: "ReadableBuffer"):
+        assert self.fd is not None, "FileStorage: closed"
+        data = memoryview(data).cast('B')
+        assert offset + len(data) <= self.size, f"FileStorage.write: {offset} past end of image"
+        n = os.pwrite(self.fd, data, offset)
+        assert n == len(data), f"FileStorage.write: short write {n} of {len(data)} bytes"
+
+    def flush(self):
+        if self.fd is not None and self.mode == 'rw':
+            os.fsync(self.fd)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class MemoryStorage(BlockStorage):
+    """
+    Image held in a bytearray, e.g. for scratch volumes.
+    If given a path, the whole image is written there on flush
+    when it has changed, so a volume built in memory is serialized once.
+    """
+    def __init__(self, data: bytearray, path: Optional[Path]=None):
+        self.data = data
+        self.path = path
+        self.changed = path is not None and not path.exists()
+        self._exported = False
+
+    @classmethod
+    def load(cls, path: Path, mode: "DeviceMode"='ro') -> "MemoryStorage":
+        """Read an image into memory, writing changes back to it on flush in rw mode"""
+        return cls(bytearray(path.read_bytes()), path if mode == 'rw' else None)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def view(self, offset: int, length: int) -> memoryview:
+        return memoryview(self.data)[offset:offset + length]
+
+    def write(self, offset: int, data: "ReadableBuffer"):
+        data = memoryview(data).cast('B')
+        self.data[offset:offset + len(data)] = data
+        self.changed = True
+
+    def buffer(self) -> Optional[memoryview]:
+        # we can't see writes through the buffer, e.g. via a mapped free map,
+        # so from now on every flush writes the image
+        self._exported = True
+        return memoryview(self.data)
+
+    def flush(self):
+        if self.path is not None and (self.changed or self._exported):
+            self.path.write_bytes(self.data)
+            self.changed = False
+
+
+def open_storage(path: Path, mode: "DeviceMode"='ro', backend: StorageBackend='mmap') -> BlockStorage:
+    match backend:
+        case 'mmap':
+            return MmapStorage(path, mode)
+        case 'file':
+            return FileStorage(path, mode)
+        case 'memory':
+            return MemoryStorage.load(path, mode)
+        case _:
+            raise ValueError(f"Unknown storage backend {backend}")
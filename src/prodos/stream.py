@@ -0,0 +1,399 @@
+import errno
+import io
+import os
+import shutil
+from collections import deque
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Final, Optional
+
+from .blocks import IndexBlock
+from .device import BlockDevice
+from .globals import block_size, block_size_bits, is_zero
+from .metadata import FileEntry, StorageType, access_byte
+from .p8datetime import P8DateTime
+
+if TYPE_CHECKING:
+    from _typeshed import ReadableBuffer, WriteableBuffer
+
+
+# EOF is a three byte field
+max_eof: Final = (1 << 24) - 1
+
+
+class FileReader(io.RawIOBase):
+    """
+    Seekable raw stream over a seedling, sapling or tree file.
+
+    Each read resolves the current mark into index number, data block number
+    and byte of block (see B.3.7 in PlainFile) and reads only the blocks it touches,
+    so large files can be streamed or randomly accessed in constant memory.
+    We keep the most recent master and index blocks since sequential reads reuse them.
+    Nil (0) block pointers read as zeros.
+    """
+    def __init__(self, device: BlockDevice, entry: FileEntry):
+        assert entry.is_plain_file, f"FileReader: not simple file {entry}"
+        super().__init__()
+        self.device = device
+        self.name = entry.file_name
+        self.key_pointer = entry.key_pointer
+        self.storage_type = entry.storage_type
+        self.eof = entry.eof
+        self._mark = 0
+        self._master: Optional[IndexBlock] = None
+        self._index: tuple[int, IndexBlock] | None = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._mark
+
+    def seek(self, offset: int, whence: int=io.SEEK_SET) -> int:
+        if self.closed:
+            raise ValueError("seek on closed file")
+        match whence:
+            case io.SEEK_SET:
+                mark = offset
+            case io.SEEK_CUR:
+                mark = self._mark + offset
+            case io.SEEK_END:
+                mark = self.eof + offset
+            case _:
+                raise ValueError(f"FileReader.seek: invalid whence {whence}")
+        if mark < 0:
+            raise ValueError(f"FileReader.seek: negative position {mark}")
+        self._mark = mark
+        return mark
+
+    def readinto(self, buffer: "WriteableBuffer") -> int:
+        if self.closed:
+            raise ValueError("read from closed file")
+        out = memoryview(buffer).cast('B')
+        n = max(0, min(len(out), self.eof - self._mark))
+        done = 0
+        while done < n:
+            offset = self._mark & (block_size - 1)
+            k = min(block_size - offset, n - done)
+            data_block = self.data_block(self._mark)
+            if data_block:
+                out[done:done+k] = self.device.read_block_view(data_block)[offset:offset+k]
+            else:
+                out[done:done+k] = bytes(k)
+            done += k
+            self._mark += k
+        return n
+
+    def data_block(self, mark: int) -> int:
+        """Resolve a mark to its data block, or 0 for a sparse block"""
+        block_number = (mark >> block_size_bits) & 0xff
+        index_number = mark >> (block_size_bits + 8)
+        match self.storage_type:
+            case StorageType.seedling:
+                return self.key_pointer if mark < block_size else 0
+            case StorageType.sapling:
+                return self._index_block(self.key_pointer).block_pointers[block_number]
+            case _:
+                if self._master is None:
+                    self._master = self.device.read_typed_block(self.key_pointer, IndexBlock)
+                index = self._master.block_pointers[index_number]
+                return self._index_block(index).block_pointers[block_number] if index else 0
+
+    def _index_block(self, block_index: int) -> IndexBlock:
+        if not self._index or self._index[0] != block_index:
+            self._index = (block_index, self.device.read_typed_block(block_index, IndexBlock))
+        return self._index[1]
+
+
+class FileWriter(io.RawIOBase):
+    """
+    Writable raw stream that builds a seedling, sapling or tree file as bytes arrive.
+
+    Each full data block is written as soon as it's complete, leaving all-zero
+    blocks sparse.  Memory use is bounded by a partial data block plus the block pointers
+    for one index block and the master block, regardless of file size.
+
+    Blocks come from extents reserved via reserve, or in growing chunks otherwise,
+    and are used in the same order as PlainFile.write: the key block first, then
+    each index block ahead of its data.  A seedling's key block is its only data block,
+    so we hold on to the first data block until we see whether a second follows.
+    Index blocks are only written once their data pointers are complete.
+
+    On close the new file's entry is passed to on_close, e.g. to add it to a directory.
+    If the stream is abandoned via an exception in a with block, fails to close,
+    or is garbage collected without being closed, we free its blocks instead.
+    """
+    def __init__(self,
+            device: BlockDevice,
+            file_name: str,
+            header_pointer: int,
+            on_close: Callable[[FileEntry], None],
+            file_type: int = 0xff,
+        ):
+        super().__init__()
+        self.device = device
+        self.name = file_name
+        self.file_type = file_type
+        self.header_pointer = header_pointer
+        self.on_close = on_close
+        self.entry: Optional[FileEntry] = None
+        self.block_list: list[int] = []
+        self._pool: deque[int] = deque()     # reserved blocks not yet used
+        self._chunk = 1                     # size of the next reservation, doubling to 256
+        self._tree = False                  # expecting a tree file, see reserve
+        self._key = 0
+        self._index = 0                     # index block reserved for the current data pointers
+        self._first: Optional[bytes] = None # first data block, until we know it's not a seedling
+        self._eof = 0
+        self._buf = bytearray()
+        self._data: list[int] = []       # data block pointers for the current index block
+        self._indexes: list[int] = []    # index block pointers for a tree's master block
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._eof
+
+    def seek(self, offset: int, whence: int=io.SEEK_SET) -> int:
+        """
+        Seek forward, extending the file with a sparse hole as though zeros were written.
+        The file is built sequentially so we can't seek backwards.
+        """
+        if self.closed:
+            raise ValueError("seek on closed file")
+        match whence:
+            case io.SEEK_SET:
+                mark = offset
+            case io.SEEK_CUR | io.SEEK_END:
+                mark = self._eof + offset
+            case _:
+                raise ValueError(f"FileWriter.seek: invalid whence {whence}")
+        if mark < self._eof:
+            raise ValueError(f"FileWriter.seek: can't seek backwards from {self._eof} to {mark}")
+        self._write_hole(mark - self._eof)
+        return mark
+
+    def write(self, b: "ReadableBuffer") -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        data = memoryview(b).cast('B')
+        n = len(data)
+        assert self._eof + n <= max_eof, f"FileWriter.write: file size exceeds {max_eof} bytes"
+        i = 0
+        if self._buf:
+            i = min(n, block_size - len(self._buf))
+            self._buf += data[:i]
+            if len(self._buf) == block_size:
+                self._write_data_block(self._buf)
+                self._buf.clear()
+        while n - i >= block_size:
+            self._write_data_block(data[i:i+block_size])
+            i += block_size
+        self._buf += data[i:]
+        self._eof += n
+        return n
+
+    def reserve(self, size: int):
+        """
+        Reserve a single extent for a file of up to size bytes before writing it,
+        so it's laid out contiguously like PlainFile.write(contiguous=True).
+        Unused blocks, e.g. due to sparse holes, are returned on close.
+        """
+        assert not self.block_list, "FileWriter.reserve: file already started"
+        n = (size + block_size - 1) >> block_size_bits
+        # data blocks plus the key block and a tree's index blocks
+        count = n if n <= 1 else n + 1 + ((n + 255) >> 8 if n > 256 else 0)
+        self._tree = n > 256
+        if count > len(self._pool):
+            self._pool.extend(self.device.allocate_extent(count - len(self._pool)))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            entry = self._finalize()
+        except BaseException:
+            self.abort()
+            raise
+        self.entry = entry
+        super().close()
+        self.on_close(entry)
+
+    def abort(self):
+        """Discard the file, freeing any blocks already allocated"""
+        while self.block_list:
+            self.device.free_block(self.block_list.pop())
+        self._release_pool()
+        super().close()
+
+    def __exit__(self, *args: Any):
+        if args[0] is not None and not self.closed:
+            self.abort()
+        return super().__exit__(*args)
+
+    def __del__(self):
+        # IOBase would close, i.e. commit, an abandoned file
+        if not self.closed and hasattr(self, 'block_list'):
+            self.abort()
+
+    def _write_hole(self, n: int):
+        assert self._eof + n <= max_eof, f"FileWriter.seek: file size exceeds {max_eof} bytes"
+        self._eof += n
+        if self._buf:
+            k = min(n, block_size - len(self._buf))
+            self._buf += bytes(k)
+            n -= k
+            if len(self._buf) == block_size:
+                self._write_data_block(self._buf)
+                self._buf.clear()
+        # whole blocks of the hole are nil pointers, without building any zeros
+        while n >= block_size:
+            self._next_data_slot()
+            self._data.append(0)
+            n -= block_size
+        self._buf += bytes(n)
+
+    def _next_data_slot(self):
+        if self._data and not self._key:
+            # a second data block means this isn't a seedling, so reserve the key block
+            self._key = self._allocate()
+            if self._first is not None:
+                self._data[0] = self._write_data(self._first)
+                self._first = None
+        if len(self._data) == 256:
+            # more than one index block of data, so this is a tree file
+            self._write_index_block()
+
+    def _write_data_block(self, blk: "ReadableBuffer"):
+        self._next_data_slot()
+        # sparse file skips write of empty blocks
+        data_block = 0
+        if not is_zero(memoryview(blk)):
+            if not self._key and not self._indexes:
+                # might be a seedling, whose data block is its key block
+                self._first = bytes(blk)
+            else:
+                data_block = self._write_data(blk)
+        self._data.append(data_block)
+
+    def _write_data(self, blk: "ReadableBuffer") -> int:
+        if (self._tree or self._indexes) and not self._index:
+            # a tree's index block goes ahead of its data
+            self._index = self._allocate()
+        data_block = self._allocate()
+        self.device.write_block(data_block, bytes(blk))
+        return data_block
+
+    def _write_index_block(self):
+        index = self._index
+        if any(self._data):
+            index = index or self._allocate()
+            self.device.write_typed_block(index, IndexBlock(block_pointers=self._data))
+        elif index:
+            self._unallocate(index)
+            index = 0
+        self._indexes.append(index)
+        self._data = []
+        self._index = 0
+
+    def _allocate(self) -> int:
+        if not self._pool:
+            # don't ask for more than is free, so we only fail if the file really won't fit
+            count = max(1, min(self._chunk, self.device.blocks_free))
+            self._pool.extend(self.device.allocate_extent(count))
+            self._chunk = min(self._chunk * 2, 256)
+        block_index = self._pool.popleft()
+        self.block_list.append(block_index)
+        return block_index
+
+    def _unallocate(self, block_index: int):
+        """Return an unwritten block to the pool"""
+        self.block_list.remove(block_index)
+        self._pool.appendleft(block_index)
+
+    def _release_pool(self):
+        self.device.release_blocks(self._pool)
+        self._pool.clear()
+
+    def _finalize(self) -> FileEntry:
+        if self._buf:
+            self._write_data_block(self._buf + bytes(block_size - len(self._buf)))
+            self._buf.clear()
+
+        if self._eof <= block_size:
+            storage_type = StorageType.seedling
+            # the only data block of a seedling is always allocated
+            key = self._allocate()
+            self.device.write_block(key, self._first or bytes(block_size))
+            self._first = None
+        else:
+            if self._indexes:
+                storage_type = StorageType.tree
+                self._write_index_block()
+                pointers = self._indexes
+            else:
+                storage_type = StorageType.sapling
+                pointers = self._data
+                if self._index:
+                    self._unallocate(self._index)
+            key = self._key or self._allocate()
+            self.device.write_typed_block(key, IndexBlock(block_pointers=pointers))
+        self._release_pool()
+
+        # key block first, like block lists read from the device
+        self.block_list.remove(key)
+        self.block_list.insert(0, key)
+
+        return FileEntry(
+            storage_type = storage_type,
+            file_name = self.name,
+            file_type = self.file_type,
+            key_pointer = key,
+            blocks_used = len(self.block_list),
+            eof = self._eof,
+            created = P8DateTime.now(),
+            access = access_byte(),
+            last_mod = P8DateTime.now(),
+            header_pointer = self.header_pointer,
+        )
+
+
+def copy_sparse(src: BinaryIO, dst: FileWriter, chunk_size: int=1 << 16):
+    """
+    Copy a host file to a FileWriter, seeking over the holes in a sparse host file
+    so they become nil block pointers without being read or scanned.
+    The host reports its data ranges via SEEK_DATA/SEEK_HOLE where supported;
+    otherwise we just copy everything and let the writer find the empty blocks.
+    """
+    fd = src.fileno()
+    st = os.fstat(fd)
+    size = st.st_size
+    # reserve space for the data the host actually stores, i.e. excluding sparse holes
+    dst.reserve(min(size, getattr(st, 'st_blocks', size) * 512))
+    pos = 0
+    if hasattr(os, 'SEEK_DATA'):
+        while pos < size:
+            try:
+                start = os.lseek(fd, pos, os.SEEK_DATA)
+                end = os.lseek(fd, start, os.SEEK_HOLE)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # nothing but a hole from pos to the end
+                    break
+                # file system doesn't support hole detection, copy the rest
+                end = size
+                start = pos
+            dst.seek(start)
+            # pread leaves the host file position alone
+            while start < end:
+                buf = os.pread(fd, min(chunk_size, end - start), start)
+                if not buf:
+                    break
+                dst.write(buf)
+                start += len(buf)
+            pos = end
+        dst.seek(size)
+    else:
+        shutil.copyfileobj(src, dst)
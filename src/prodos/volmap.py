@@ -10,6 +10,7 @@ from bitarray import bitarray
 from rich.console import Console
 from rich.text import Text
 
+from .file import ExtendedFile, PlainFile
 from .globals import block_size
 from .metadata import FileEntry, StorageType, VolumeDirectoryHeaderEntry
 from .volume import Volume
@@ -110,7 +111,7 @@ def walk_volume(volume: Volume) -> BlockMap:
         Mark blocks with usage type and log warnings for conflicts.
 
         Args:
-            blocks_with_types: List of (block_idx, block_type) tuples from typed access log
+            blocks_with_types: List of (block_idx, block_type) tuples, as from walk_blocks or the typed access log
             cwd: Current path for logging
             is_voldir: True if marking volume directory blocks
         """
@@ -124,15 +125,13 @@ def walk_volume(volume: Volume) -> BlockMap:
                 )
             usage[block_idx] = new_usage
 
-    # Walk all files and directories recursively, tracking block access
+    # Walk all files and directories recursively, following their block pointers
     def walk_directory(dir_entry: FileEntry, cwd: str = "/"):
-        """Recursively walk a directory and mark all blocks it accesses."""
-        # Mark session before reading to track which blocks are accessed
-        mark = device.mark_session()
+        """Recursively walk a directory and mark all blocks it uses."""
         dir_file = volume.read_directory(dir_entry)
 
-        # Get all blocks read during directory read (these are directory blocks)
-        dir_blocks = device.get_typed_access_log('r', mark)
+        # The directory's own blocks, from following its next pointers
+        dir_blocks = [(i, 'DirectoryBlock') for i in dir_file.block_list]
         mark_blocks(usage, dir_blocks, cwd, is_voldir=dir_entry.is_volume_dir)
 
         # Process each entry in the directory
@@ -154,31 +153,21 @@ def walk_volume(volume: Volume) -> BlockMap:
                 walk_extended_file(entry, entry_path)
 
     def walk_file(entry: FileEntry, cwd: str):
-        """Walk a file and mark all its blocks by reading it."""
-        # Mark session before reading to track which blocks are accessed
-        mark = device.mark_session()
+        """Walk a file's index blocks and mark all its blocks without reading its data."""
         try:
-            volume.read_simple_file(entry)
+            blocks_with_types = list(PlainFile.walk_blocks(device, entry))
         except (AssertionError, Exception) as e:
             logging.warning(f"Error reading file '{cwd}': {e}")
             return
-
-        # Get all blocks read during file read with their types
-        blocks_with_types = device.get_typed_access_log('r', mark)
         mark_blocks(usage, blocks_with_types, cwd)
 
     def walk_extended_file(entry: FileEntry, cwd: str):
         """Walk an extended file (storage type 5) and mark all its blocks."""
-        # Mark session before reading to track which blocks are accessed
-        mark = device.mark_session()
         try:
-            volume.read_extended_file(entry)
+            blocks_with_types = list(ExtendedFile.walk_blocks(device, entry))
         except (AssertionError, Exception) as e:
             logging.warning(f"Error reading extended file '{cwd}': {e}")
             return
-
-        # Get all blocks read during file read with their types
-        blocks_with_types = device.get_typed_access_log('r', mark)
         mark_blocks(usage, blocks_with_types, cwd)
 
     # Get header for bitmap info
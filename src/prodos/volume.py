@@ -1,11 +1,13 @@
 import logging
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Self
+from typing import Iterator, Self
 
+from .accesslog import AccessLog
 from .blocks import DirectoryBlock
-from .device import BlockDevice, DeviceFormat, DeviceMode
-from .directory import DirectoryFile
-from .file import ExtendedFile, PlainFile
+from .device import BlockDevice, DeviceFormat, DeviceMode, FreePolicy
+from .directory import DirectoryCache, DirectoryFile
+from .file import ExtendedFile, PlainFile, legal_path
 from .globals import (
     block_size,
     entries_per_block,
@@ -19,6 +21,9 @@ from .metadata import (
     VolumeDirectoryHeaderEntry,
     access_byte
 )
+from .pathglob import PathPattern
+from .storage import StorageBackend
+from .stream import FileReader, FileWriter
 
 
 class Volume:
@@ -35,6 +40,7 @@ class Volume:
 
     def __init__(self, device: BlockDevice):
         self.device = device
+        self.dcache = DirectoryCache()
         vkb = self.device.read_typed_block(volume_key_block, DirectoryBlock, unsafe=True)
         assert isinstance(vkb.header_entry, VolumeDirectoryHeaderEntry), \
             f"Volume header entry has unexpected type {type(vkb.header_entry)}"
@@ -44,8 +50,17 @@ class Volume:
         self.device.reset_free_map(vh.bitmap_pointer)
 
     @classmethod
-    def from_file(cls, source: Path, mode: DeviceMode='ro') -> Self:
-        return cls(BlockDevice(source, mode))
+    def from_file(cls,
+            source: Path,
+            mode: DeviceMode='ro',
+            cache_size: int=0,
+            access_log: AccessLog | None=None,
+            mapped_free_map: bool=False,
+            backend: StorageBackend='mmap',
+            free_policy: FreePolicy=FreePolicy.zero,
+        ) -> Self:
+        return cls(BlockDevice(source, mode, cache_size=cache_size, access_log=access_log,
+            mapped_free_map=mapped_free_map, backend=backend, free_policy=free_policy))
 
     @classmethod
     def create(cls,
@@ -53,9 +68,14 @@ class Volume:
             volume_name: str = 'PYP8',
             total_blocks: int = 65535,
             format: DeviceFormat = DeviceFormat.prodos,
-            loader_path: Path | None = None
+            loader_path: Path | None = None,
+            access_log: AccessLog | None = None,
+            mapped_free_map: bool = False,
+            backend: StorageBackend = 'mmap',
+            preallocate: bool = False,
         ) -> Self:
-        device = BlockDevice.create(dest, total_blocks, bit_map_pointer=6, format=format) #TODO what is this magic 6
+        device = BlockDevice.create(dest, total_blocks, bit_map_pointer=6, format=format, access_log=access_log,
+            mapped_free_map=mapped_free_map, backend=backend, preallocate=preallocate) #TODO what is this magic 6
         # reserve two blocks for loader
         device.allocate_block()
         device.allocate_block()
@@ -92,11 +112,39 @@ class Volume:
 
     def parent_directory(self, entry: FileEntry) -> DirectoryFile:
         assert entry.header_pointer >= 2, f"parent_directory: bad header_pointer {entry.header_pointer}"
-        return DirectoryFile.read(self.device, entry.header_pointer)
+        return self.dcache.read(self.device, entry.header_pointer)
 
     def read_directory(self, dir_entry: FileEntry) -> DirectoryFile:
         assert dir_entry.is_dir, f"read_directory: not a directory {dir_entry}"
-        return DirectoryFile.read(self.device, dir_entry.key_pointer)
+        return self.dcache.read(self.device, dir_entry.key_pointer)
+
+    @contextmanager
+    def transaction(self) -> Iterator[Self]:
+        """
+        Defer directory writes until the end of the with block, then write each changed
+        directory block once, followed by a single write of the volume bitmap.
+        Blocks that removed entries used are only freed after that.
+        The storage itself isn't flushed, see BlockDevice.flush.
+        If the block exits with an exception the directory changes and frees are dropped
+        and the free map rolled back, so the volume is left as it was.
+        """
+        free_map = self.device.free_map.copy() if not self.dcache.batch else None
+        self.dcache.batch += 1
+        failed = True
+        try:
+            yield self
+            failed = False
+        finally:
+            self.dcache.batch -= 1
+            if free_map is not None:
+                if failed:
+                    self.dcache.clear()
+                    self.device.cache_clear()
+                    self.device.restore_free_map(free_map)
+                else:
+                    self.dcache.commit(self.device)
+                if self.device.allocator.dirty:
+                    self.device.write_free_map()
 
     def read_simple_file(self, entry: FileEntry) -> PlainFile:
         return PlainFile.from_entry(self.device, entry)
@@ -104,6 +152,24 @@ class Volume:
     def read_extended_file(self, entry: FileEntry) -> ExtendedFile:
         return ExtendedFile.from_entry(self.device, entry)
 
+    def open(self, entry: FileEntry) -> FileReader:
+        """Open a simple file as a seekable raw stream without reading it into memory"""
+        return FileReader(self.device, entry)
+
+    def create_file(self, path: str) -> FileWriter:
+        """
+        Open a writable stream for a new simple file at path, see DirectoryFile.create_file.
+        The file name is made legal like the CLI's, see legal_path.
+        """
+        parent, _, name = path.rstrip('/').rpartition('/')
+        name = legal_path(name)
+        if not name or len(name) > 15:
+            raise ValueError(f"Invalid file name '{name}' in {path}")
+        parent_entry = self.path_entry(parent or '/')
+        if not parent_entry or not parent_entry.is_dir:
+            raise ValueError(f"Parent directory {parent or '/'} not found")
+        return self.read_directory(parent_entry).create_file(name)
+
     def write_loader(self, loader_path: Path):
         data = open(loader_path, 'rb').read()
         if len(data) > 2 * block_size:
@@ -116,22 +182,29 @@ class Volume:
 
     def read_loader(self) -> bytes:
         """Read the boot loader from blocks 0 and 1."""
-        return self.device.read_block(0) + self.device.read_block(1)
+        return bytes(self.device.read_blocks_view(0, 2))
 
     def path_entry(self, path: str) -> FileEntry|None:
+        # only found entries are cached, since a miss could be created at any time
+        key = path.strip('/').upper()
+        entry = self.dcache.paths.get(key)
+        if entry is not None:
+            return entry
         entries = self.glob_paths([path])
         if len(entries) > 1:
             raise ValueError("path_entry: globbing not supported")
-        return entries[0] if entries else None
+        if not entries:
+            return None
+        entry = self.dcache.paths[key] = entries[0]
+        return entry
 
     def glob_paths(self, paths: list[str]) -> list[FileEntry]:
+        """Match path patterns in a single pass, reading each directory at most once"""
         entries: list[FileEntry] = []
-        uniq = {p.strip('/') for p in paths}
-        root = self.root
-        for p in uniq:
-            if not p:
-                entries.append(FileEntry.root)
-            else:
-                entries += root.glob_path(p.split('/'))
+        parts = [p.strip('/').split('/') for p in paths if p.strip('/')]
+        if len(parts) < len(paths):
+            entries.append(FileEntry.root)
+        if parts:
+            entries += PathPattern.compile(parts).glob(self.root, self.read_directory)
         return entries
 
@@ -0,0 +1,90 @@
+"""Tests for the configurable block device access logs."""
+from pathlib import Path
+
+import pytest
+
+from prodos.accesslog import (
+    AccessLog,
+    AccessLogEntry,
+    CompactAccessLog,
+    NullAccessLog,
+    RingAccessLog,
+    StreamAccessLog
+)
+from prodos.device import BlockDevice
+from prodos.volume import Volume
+
+
+def fill(log: AccessLog):
+    log.append('a', 10)
+    log.append('w', 10, 'IndexBlock')
+    log.append('r', 0xffff, 'DirectoryBlock')
+    log.append('f', 10)
+
+
+expected = [
+    AccessLogEntry('a', 10, ''),
+    AccessLogEntry('w', 10, 'IndexBlock'),
+    AccessLogEntry('r', 0xffff, 'DirectoryBlock'),
+    AccessLogEntry('f', 10, ''),
+]
+
+
+@pytest.mark.parametrize('log', [AccessLog(), CompactAccessLog(), RingAccessLog(10)])
+def test_log_retains_entries(log: AccessLog):
+    fill(log)
+    assert len(log) == 4
+    assert list(log.entries()) == expected
+    assert list(log.entries(2)) == expected[2:]
+
+
+def test_ring_log_drops_old_entries():
+    log = RingAccessLog(3)
+    fill(log)
+    assert log.first == 1
+    assert list(log.entries(1)) == expected[1:]
+    with pytest.raises(LookupError):
+        log.entries(0)
+
+
+def test_null_log_counts_only():
+    log = NullAccessLog()
+    fill(log)
+    assert len(log) == 4
+    assert list(log.entries(4)) == []
+    with pytest.raises(LookupError):
+        log.entries(3)
+
+
+def test_stream_log_writes_file(tmp_path: Path):
+    log_path = tmp_path / "access.log"
+    log = StreamAccessLog(log_path, tail=2)
+    fill(log)
+    log.close()
+    log.append('r', 1)
+    assert log_path.read_text().splitlines() == [str(e) for e in expected]
+    assert list(log.entries(3)) == [expected[3], AccessLogEntry('r', 1, '')]
+
+
+@pytest.mark.parametrize('log', [CompactAccessLog(), RingAccessLog(100)])
+def test_device_with_log(tmp_path: Path, log: AccessLog):
+    """Test that volume operations relying on mark_session work with other logs."""
+    device = BlockDevice.create(tmp_path / "log.po", 280, bit_map_pointer=6, access_log=log)
+    del device
+    volume = Volume.create(tmp_path / "vol.po", "LOG", total_blocks=280, access_log=log)
+    mark = volume.device.mark_session()
+    root = volume.root
+    assert len(root.block_list) == 4
+    assert volume.device.get_typed_access_log('r', mark) == [(i, 'DirectoryBlock') for i in range(2, 6)]
+
+
+def test_volume_with_null_log(tmp_path: Path):
+    """Test that block lists don't depend on the access log."""
+    volume = Volume.create(tmp_path / "null.po", "NULL", total_blocks=280, access_log=NullAccessLog())
+    with volume.create_file("/DATA") as f:
+        f.write(b'x' * 2000)
+    root = volume.root
+    assert root.block_list == [2, 3, 4, 5]
+    entry = root.file_entry("DATA")
+    assert entry
+    assert len(volume.read_simple_file(entry).block_list) == entry.blocks_used == 5
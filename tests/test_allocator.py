@@ -0,0 +1,79 @@
+"""Tests for the first-fit BlockAllocator."""
+from bitarray import bitarray
+
+from prodos.allocator import BlockAllocator
+
+
+def make_allocator(bits: str) -> BlockAllocator:
+    free_map = bitarray(bits)
+    return BlockAllocator(free_map, len(free_map))
+
+
+def test_allocate_first_fit():
+    alloc = make_allocator('00101101')
+    assert alloc.allocate() == [2]
+    assert alloc.allocate(2) == [4, 5]
+    assert alloc.next_free() == 7
+    assert alloc.free_map == bitarray('00000001')
+
+
+def test_free_rewinds_cursor():
+    """Freeing a block below the cursor makes it the next allocation."""
+    alloc = make_allocator('11111111')
+    assert alloc.allocate(6) == [0, 1, 2, 3, 4, 5]
+    alloc.mark_free(1)
+    assert alloc.allocate(2) == [1, 6]
+
+
+def test_allocate_ignores_bits_past_end():
+    """Trailing bitmap bits past the end of the volume are never allocated."""
+    free_map = bitarray('00011111')
+    alloc = BlockAllocator(free_map, 5)
+    assert alloc.allocate(2) == [3, 4]
+    assert alloc.next_free() is None
+
+
+def test_allocate_device_full():
+    alloc = make_allocator('0100')
+    try:
+        alloc.allocate(2)
+    except AssertionError as e:
+        assert "Device full" in str(e)
+    else:
+        assert False, "Expected allocation to fail"
+
+
+def test_free_runs():
+    alloc = make_allocator('0110011100001')
+    assert list(alloc.free_runs()) == [(1, 2), (5, 3), (12, 1)]
+
+
+def test_allocate_extent_best_fit():
+    """The smallest free run that fits is used, leaving larger runs intact."""
+    alloc = make_allocator('1111000110')
+    assert alloc.allocate_extent(2) == [7, 8]
+    assert alloc.allocate_extent(3) == [0, 1, 2]
+    assert alloc.free_map == bitarray('0001000000')
+
+
+def test_allocate_extent_fallback():
+    """With no long enough run we fall back to first-fit blocks."""
+    alloc = make_allocator('1101101')
+    assert alloc.allocate_extent(4) == [0, 1, 3, 4]
+
+
+def test_free_count_and_dirty_blocks():
+    """The free count and dirty bitmap blocks track every change to the map."""
+    free_map = bitarray(3 * 4096)
+    free_map.setall(1)
+    alloc = BlockAllocator(free_map, len(free_map))
+    assert alloc.free_count == 3 * 4096 and not alloc.dirty
+    alloc.allocate(2)
+    assert alloc.free_count == 3 * 4096 - 2 and alloc.dirty == {0}
+    alloc.mark_used(8192)
+    alloc.mark_used(8192)
+    assert alloc.free_count == 3 * 4096 - 3 and alloc.dirty == {0, 2}
+    alloc.dirty.clear()
+    alloc.mark_free(0)
+    assert alloc.free_count == 3 * 4096 - 2 and alloc.dirty == {0}
+    assert alloc.free_count == free_map.count(1)
@@ -195,6 +195,39 @@ def test_directory_block_synthetic():
     assert len(unpacked.file_entries) == 13
 
 
+def test_file_entry_lazy_decode():
+    """Test that unpacked file entries decode their fields on first use."""
+    entry = FileEntry(
+        storage_type=StorageType.sapling,
+        file_name="LAZY",
+        file_type=0x06,
+        key_pointer=123,
+        blocks_used=4,
+        eof=1500,
+        aux_type=0x2000,
+        header_pointer=2,
+    )
+    packed = entry.pack()
+    # empty slots are distinct entries, so changing one can't change the others
+    empty = FileEntry.unpack(bytes(39))
+    assert empty == FileEntry.empty and empty is not FileEntry.empty
+
+    lazy = FileEntry.unpack(packed)
+    assert lazy.file_name == "LAZY" and lazy.is_active
+    assert lazy._raw is not None
+    assert lazy.pack() == packed
+    assert lazy.eof == 1500
+    assert lazy._raw is None
+    assert not hasattr(lazy, '__dict__')
+    assert lazy == entry
+
+    # changing an undecoded entry decodes it first
+    lazy = FileEntry.unpack(packed)
+    lazy.header_pointer = 7
+    assert lazy.key_pointer == 123
+    assert FileEntry.unpack(lazy.pack()).header_pointer == 7
+
+
 # ===== IndexBlock Tests =====
 
 def test_index_block_real_data():
@@ -230,13 +263,23 @@ def test_index_block_synthetic():
     assert len(packed) == 512
 
     unpacked = IndexBlock.unpack(packed)
-    assert unpacked.block_pointers[:4] == [100, 101, 102, 103]
-    assert unpacked.block_pointers[4:] == [0] * 252
+    assert list(unpacked.block_pointers[:4]) == [100, 101, 102, 103]
+    assert list(unpacked.block_pointers[4:]) == [0] * 252
 
     # Test round-trip
     assert packed == unpacked.pack()
 
 
+def test_index_block_short_pointers():
+    """Test that packing pads short pointer lists without changing them."""
+    pointers = [0x1234, 0, 0xabcd]
+    packed = IndexBlock(block_pointers=pointers).pack()
+    assert pointers == [0x1234, 0, 0xabcd]
+    assert packed[:3] == bytes([0x34, 0, 0xcd])
+    assert packed[256:259] == bytes([0x12, 0, 0xab])
+    assert not any(packed[3:256]) and not any(packed[259:])
+
+
 def test_index_block_max_pointers():
     """Test IndexBlock with maximum pointer values."""
     # ProDOS uses 16-bit block pointers
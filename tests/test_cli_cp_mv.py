@@ -4,6 +4,8 @@ import pytest
 from typer.testing import CliRunner
 
 from prodos.cli import app
+from prodos.metadata import SubdirectoryHeaderEntry
+from prodos.volume import Volume
 
 runner = CliRunner(catch_exceptions=False)
 
@@ -101,6 +103,28 @@ def test_mv_dir_rename(vol_with_file: Path) -> None:
     assert result.exit_code == 0
 
 
+def test_mv_out_compacts_source(vol_with_file: Path) -> None:
+    runner.invoke(app, ["mkdir", str(vol_with_file), "/SRC"])
+    runner.invoke(app, ["mkdir", str(vol_with_file), "/DST"])
+    for i in range(15):
+        runner.invoke(app, ["mkdir", str(vol_with_file), f"/SRC/SUB{i}"])
+    result = runner.invoke(app, ["mv", str(vol_with_file), "/SRC/SUB1?", "/DST"])
+    assert result.exit_code == 0
+
+    volume = Volume.from_file(vol_with_file)
+    src, dst = volume.path_entry("/SRC"), volume.path_entry("/DST")
+    assert src and dst
+    assert len(volume.read_directory(src).block_list) == 1
+    assert len(volume.read_directory(dst).glob_file("SUB1*")) == 5
+    # moved and shuffled subdirectories point back at their slots
+    for d in (volume.read_directory(src), volume.read_directory(dst)):
+        for e in d.glob_file("*"):
+            sub = volume.read_directory(e)
+            assert isinstance(sub.header, SubdirectoryHeaderEntry)
+            assert sub.header.parent_pointer == d.block_list[0]
+            assert d.entries[sub.header.parent_entry_number] == e
+
+
 def test_mv_root_directory_error(vol_with_file: Path) -> None:
     runner.invoke(app, ["mkdir", str(vol_with_file), "/DIR"])
 
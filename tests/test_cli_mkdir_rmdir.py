@@ -4,6 +4,7 @@ import pytest
 from typer.testing import CliRunner
 
 from prodos.cli import app
+from prodos.volume import Volume
 
 runner = CliRunner(catch_exceptions=False)
 
@@ -75,6 +76,22 @@ def test_rmdir(vol_path: Path) -> None:
     assert "TEST" not in result.stdout
 
 
+def test_rmdir_compacts_parent(vol_path: Path) -> None:
+    runner.invoke(app, ["mkdir", str(vol_path), "/TEST"])
+    # enough entries to need a second directory block
+    for i in range(15):
+        runner.invoke(app, ["mkdir", str(vol_path), f"/TEST/SUB{i}"])
+    for i in range(14):
+        result = runner.invoke(app, ["rmdir", str(vol_path), f"/TEST/SUB{i}"])
+        assert result.exit_code == 0
+
+    volume = Volume.from_file(vol_path)
+    entry = volume.path_entry("/TEST")
+    assert entry
+    assert len(volume.read_directory(entry).block_list) == 1
+    assert volume.path_entry("/TEST/SUB14")
+
+
 def test_mkdir_already_exists(vol_path: Path) -> None:
     """Test mkdir fails when directory already exists"""
     runner.invoke(app, ["mkdir", str(vol_path), "/TEST"])
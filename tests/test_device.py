@@ -1,4 +1,6 @@
 """Tests for BlockDevice methods including access logging."""
+import gc
+import sys
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Iterator
@@ -7,8 +9,10 @@ import pytest
 from bitarray import bitarray
 
 from prodos.blocks import BitmapBlock, DirectoryBlock
-from prodos.device import AccessLogEntry, BlockDevice, DeviceFormat
+from prodos.device import AccessLogEntry, BlockDevice, DeviceFormat, FreePolicy
+from prodos.file import PlainFile
 from prodos.globals import block_size
+from prodos.storage import MADV_REMOVE, MmapStorage
 from prodos.volume import Volume
 
 
@@ -64,7 +68,7 @@ def test_read_typed_block_logs_block_type(test_device: BlockDevice):
     assert isinstance(blk, DirectoryBlock)
 
     # Check the access log
-    log_entries = test_device._access_log[mark:]    # pyright: ignore[reportPrivateUsage]
+    log_entries = list(test_device._access_log.entries(mark))    # pyright: ignore[reportPrivateUsage]
     assert len(log_entries) == 1
     assert log_entries[0].access_type == 'r'
     assert log_entries[0].block_index == 2
@@ -83,7 +87,7 @@ def test_write_typed_block_logs_block_type(empty_device: BlockDevice):
     empty_device.write_typed_block(10, blk)
 
     # Check the access log
-    log_entries = empty_device._access_log[mark:]   # pyright: ignore[reportPrivateUsage]
+    log_entries = list(empty_device._access_log.entries(mark))   # pyright: ignore[reportPrivateUsage]
     assert len(log_entries) == 1
     assert log_entries[0].access_type == 'w'
     assert log_entries[0].block_index == 10
@@ -99,7 +103,7 @@ def test_write_block_without_type(empty_device: BlockDevice):
     empty_device.write_block(10, data)
 
     # Check the access log
-    log_entries = empty_device._access_log[mark:]   # pyright: ignore[reportPrivateUsage]
+    log_entries = list(empty_device._access_log.entries(mark))   # pyright: ignore[reportPrivateUsage]
     assert len(log_entries) == 1
     assert log_entries[0].access_type == 'w'
     assert log_entries[0].block_index == 10
@@ -115,7 +119,7 @@ def test_write_block_with_type(empty_device: BlockDevice):
     empty_device.write_block(10, data, block_type='CustomBlock')
 
     # Check the access log
-    log_entries = empty_device._access_log[mark:]   # pyright: ignore[reportPrivateUsage]
+    log_entries = list(empty_device._access_log.entries(mark))   # pyright: ignore[reportPrivateUsage]
     assert len(log_entries) == 1
     assert log_entries[0].access_type == 'w'
     assert log_entries[0].block_index == 10
@@ -129,7 +133,7 @@ def test_allocate_block_logs_allocation(empty_device: BlockDevice):
     block_idx = empty_device.allocate_block()
 
     # Check the access log
-    log_entries = empty_device._access_log[mark:]   # pyright: ignore[reportPrivateUsage]
+    log_entries = list(empty_device._access_log.entries(mark))   # pyright: ignore[reportPrivateUsage]
     assert len(log_entries) == 1
     assert log_entries[0].access_type == 'a'
     assert log_entries[0].block_index == block_idx
@@ -146,7 +150,7 @@ def test_free_block_logs_free(empty_device: BlockDevice):
     empty_device.free_block(block_idx)
 
     # Check the access log - should have write (zeroing) and free
-    log_entries = empty_device._access_log[mark:]   # pyright: ignore[reportPrivateUsage]
+    log_entries = list(empty_device._access_log.entries(mark))   # pyright: ignore[reportPrivateUsage]
     assert len(log_entries) >= 2
 
     # Last entry should be the free operation
@@ -283,6 +287,52 @@ def test_device_create_formats(tmp_path: Path):
     assert device_2mg.total_blocks == 280
 
 
+def punches_holes(tmp_path: Path) -> bool:
+    """Whether the host can release the storage of a mapped file's pages, see MmapStorage.discard"""
+    if MADV_REMOVE is None:
+        return False
+    probe = tmp_path / "probe"
+    probe.write_bytes(b'\xff' * (1 << 20))
+    before = probe.stat().st_blocks
+    storage = MmapStorage(probe, 'rw')
+    storage.discard(0, 1 << 20)
+    storage.flush()
+    punched = probe.stat().st_blocks < before
+    del storage
+    probe.unlink()
+    return punched
+
+
+def sparse_files(tmp_path: Path) -> bool:
+    """Whether the host file system leaves a file extended by truncate unallocated"""
+    probe = tmp_path / "probe"
+    with open(probe, 'wb') as f:
+        f.truncate(1 << 20)
+    sparse = probe.stat().st_blocks * 512 < 1 << 20
+    probe.unlink()
+    return sparse
+
+
+def test_device_create_sparse(tmp_path: Path):
+    """New images are sized without writing zeros, and only the volume structure is written."""
+    sparse_path = tmp_path / "sparse.po"
+    volume = Volume.create(sparse_path, "SPARSE", total_blocks=65535)
+    volume.device.flush()
+    size = 65535 * block_size
+    assert sparse_path.stat().st_size == size
+    if sparse_files(tmp_path):
+        assert sparse_path.stat().st_blocks * 512 < size
+    # volume directory and bitmap blocks
+    assert volume.device.get_access_log('w') == list(range(2, 22))
+
+    full_path = tmp_path / "full.po"
+    Volume.create(full_path, "FULL", total_blocks=65535, preallocate=True).device.flush()
+    assert full_path.stat().st_size == size
+    assert full_path.stat().st_blocks * 512 >= size
+    # same bitmap and blank blocks after the volume directory
+    assert full_path.read_bytes()[6*block_size:] == sparse_path.read_bytes()[6*block_size:]
+
+
 def test_free_map_operations(empty_device: BlockDevice):
     """Test that free map is correctly maintained."""
     initial_free = empty_device.blocks_free
@@ -298,6 +348,55 @@ def test_free_map_operations(empty_device: BlockDevice):
     assert empty_device.free_map[idx]
 
 
+@pytest.mark.parametrize('policy', list(FreePolicy))
+def test_free_policy(tmp_path: Path, policy: FreePolicy):
+    """Freed blocks are zeroed immediately, never, on reuse or on flush, per the free policy."""
+    img_path = tmp_path / "free.po"
+    Volume.create(img_path, "FREE", total_blocks=1024).device.flush()
+    volume = Volume.from_file(img_path, mode='rw', free_policy=policy)
+    device = volume.device
+    with volume.create_file('/BIG') as f:
+        f.write(b'\xa5' * 64 * block_size)
+    entry = volume.path_entry('/BIG')
+    assert entry
+    blocks = list(PlainFile.from_entry(device, entry).block_list)
+    device.flush()
+    host_blocks = img_path.stat().st_blocks
+
+    mark = device.mark_session()
+    volume.parent_directory(entry).remove_simple_file(entry)
+    zeroed = [i for i in blocks if not any(device.read_block(i, unsafe=True))]
+    assert zeroed == (blocks if policy == FreePolicy.zero else [])
+    assert set(device.get_access_log('w', mark)).isdisjoint(blocks) == (policy != FreePolicy.zero)
+
+    reused = device.allocate_block()
+    assert reused in blocks
+    assert any(device.read_block(reused, unsafe=True)) == (policy == FreePolicy.lazy)
+    device.flush()
+    if policy == FreePolicy.punch:
+        assert not any(any(device.read_block(i, unsafe=True)) for i in blocks if i != reused)
+        if punches_holes(tmp_path):
+            assert img_path.stat().st_blocks < host_blocks
+
+    # a freed block that's written again keeps its new data
+    device.free_block(reused)
+    device.write_block(reused, b'\x5a' * block_size)
+    device.flush()
+    assert device.read_block(reused) == b'\x5a' * block_size
+
+
+def test_device_init_failure(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """A device that fails to open is collected quietly."""
+    bad_path = tmp_path / "bad.po"
+    bad_path.write_bytes(bytes(1000))
+    unraisable: list[object] = []
+    monkeypatch.setattr(sys, 'unraisablehook', unraisable.append)
+    with pytest.raises(AssertionError):
+        BlockDevice(bad_path)
+    gc.collect()
+    assert unraisable == []
+
+
 def test_write_free_map_uses_typed_blocks(empty_device: BlockDevice):
     """Test that write_free_map uses write_typed_block for logging."""
     # Modify free map
@@ -316,3 +415,122 @@ def test_write_free_map_uses_typed_blocks(empty_device: BlockDevice):
     assert len(typed_writes) > 0
     for _, block_type in typed_writes:
         assert block_type == 'BitmapBlock'
+
+
+def test_flush_writes_only_dirty_bitmap_blocks(tmp_path: Path):
+    """Adding a file to a large volume rewrites just the bitmap block covering it."""
+    img_path = tmp_path / "big.po"
+    Volume.create(img_path, "BIG", total_blocks=65535).device.flush()
+    volume = Volume.from_file(img_path, mode='rw')
+    device = volume.device
+    assert device.bitmap_blocks == 16
+    free = device.blocks_free
+    assert free == device.free_map.count(1)
+
+    with volume.create_file('/ONE') as f:
+        f.write(b'x' * 3 * block_size)
+    assert device.blocks_free == free - 4
+    mark = device.mark_session()
+    device.flush()
+    assert device.get_typed_access_log('w', mark) == [(6, 'BitmapBlock')]
+
+
+def test_mapped_free_map(tmp_path: Path):
+    """A mapped free map updates the bitmap blocks in place, without reading or writing them."""
+    img_path = tmp_path / "mapped.po"
+    Volume.create(img_path, "MAPPED", total_blocks=280, mapped_free_map=True)
+    volume = Volume.from_file(img_path, mode='rw', mapped_free_map=True)
+    device = volume.device
+    free = device.blocks_free
+    with volume.create_file('/ONE') as f:
+        f.write(b'x' * 3 * block_size)
+    assert device.blocks_free == free - 4
+    assert 'BitmapBlock' not in {t for (_, t) in device.get_typed_access_log('rw', 0)}
+
+    # the image already has the new bitmap, even before any flush
+    device.storage.flush()
+    copy = Volume.from_file(img_path)
+    assert copy.device.free_map == device.free_map
+    assert copy.device.blocks_free == free - 4
+
+    # mapping an existing bitmap leaves it as it is
+    before = img_path.read_bytes()
+    del device, volume, copy
+    mapped = BlockDevice(img_path, mode='rw', bit_map_pointer=6, mapped_free_map=True)
+    assert mapped.blocks_free == free - 4
+    mapped.flush()
+    assert img_path.read_bytes() == before
+
+
+def test_block_cache_hits_and_misses(test_device: BlockDevice):
+    """Test that the decoded block cache serves repeat reads and counts hits."""
+    test_device.cache_size = 4
+    test_device.cache_clear()
+
+    a = test_device.read_typed_block(2, DirectoryBlock)
+    b = test_device.read_typed_block(2, DirectoryBlock)
+    assert a is b
+
+    info = test_device.cache_info()
+    assert (info.hits, info.misses, info.maxsize, info.currsize) == (1, 1, 4, 1)
+
+    # cache hits are still logged as reads
+    mark = test_device.mark_session()
+    test_device.read_typed_block(2, DirectoryBlock)
+    assert test_device.get_typed_access_log('r', mark) == [(2, 'DirectoryBlock')]
+
+
+def test_block_cache_is_bounded(test_device: BlockDevice):
+    """Test that the least recently used block is evicted."""
+    test_device.cache_size = 2
+    test_device.cache_clear()
+
+    for i in (2, 3, 2, 4):
+        test_device.read_typed_block(i, DirectoryBlock)
+
+    assert test_device.cache_info().currsize == 2
+    test_device.read_typed_block(2, DirectoryBlock)     # still cached
+    test_device.read_typed_block(3, DirectoryBlock)     # evicted
+    assert test_device.cache_info().hits == 2
+    assert test_device.cache_info().misses == 4
+
+
+def test_block_cache_invalidated_by_write(test_device: BlockDevice):
+    """Test that writing or freeing a block drops its cached decoding."""
+    test_device.cache_size = 8
+    test_device.cache_clear()
+
+    blk = test_device.read_typed_block(2, DirectoryBlock)
+    test_device.write_typed_block(2, blk)
+    assert test_device.read_typed_block(2, DirectoryBlock) is not blk
+
+    idx = test_device.allocate_block()
+    test_device.write_typed_block(idx, blk)
+    test_device.read_typed_block(idx, DirectoryBlock)
+    test_device.free_block(idx)
+    assert test_device.cache_info().currsize == 1
+
+
+def test_read_block_view_zero_copy(empty_device: BlockDevice):
+    """Test that block views share memory with the device and log each block read."""
+    data = bytes(range(256)) * 2
+    empty_device.write_block(10, data)
+    empty_device.write_block(11, data[::-1])
+
+    mark = empty_device.mark_session()
+    view = empty_device.read_block_view(10)
+    assert isinstance(view, memoryview)
+    assert view == data
+    assert empty_device.read_blocks_view(10, 2) == data + data[::-1]
+    assert empty_device.get_access_log('r', mark) == [10, 10, 11]
+
+    # the view reflects later writes since it isn't a copy
+    empty_device.write_block(10, bytes(block_size))
+    assert not any(view)
+
+
+def test_read_blocks_view_checks_free_blocks(empty_device: BlockDevice):
+    empty_device.write_block(10, bytes(block_size))
+    with pytest.raises(AssertionError):
+        empty_device.read_blocks_view(10, 2)
+    assert len(empty_device.read_blocks_view(10, 2, unsafe=True)) == 2 * block_size
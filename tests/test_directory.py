@@ -0,0 +1,335 @@
+"""Tests for directory entry lookup."""
+from pathlib import Path
+
+import pytest
+
+from prodos.directory import DirectoryFile
+from prodos.file import PlainFile
+from prodos.metadata import SubdirectoryHeaderEntry
+from prodos.volume import Volume
+
+
+@pytest.fixture
+def subdir(tmp_path: Path) -> DirectoryFile:
+    volume = Volume.create(tmp_path / "dir.po", "DIR", total_blocks=1600)
+    volume.root.add_directory("SUB")
+    entry = volume.path_entry("/SUB")
+    assert entry
+    d = volume.read_directory(entry)
+    # enough files to span several directory blocks
+    for i in range(40):
+        d.add_simple_file(PlainFile(device=volume.device, file_name=f"F{i}", data=bytes([i+1])))
+    return d
+
+
+def test_literal_lookup(subdir: DirectoryFile):
+    e = subdir.file_entry("f17")
+    assert e and e.file_name == "F17"
+    assert subdir.file_entry("F40") is None
+    assert [e.file_name for e in subdir.glob_file("F3?")] == [f"F3{i}" for i in range(10)]
+    # fresh read builds the same index
+    d = DirectoryFile.read(subdir.device, subdir.block_list[0])
+    assert d.file_entry("F39") == subdir.file_entry("F39")
+
+
+def test_lookup_after_mutation(subdir: DirectoryFile):
+    e = subdir.file_entry("F5")
+    assert e
+    subdir.move_simple_file(e, subdir, "RENAMED")
+    assert subdir.file_entry("F5") is None
+    assert subdir.file_entry("RENAMED") == e
+
+    subdir.remove_simple_file(e)
+    assert subdir.file_entry("RENAMED") is None
+    assert subdir.entry_slot(e) is None
+
+    # other entries are still found
+    f = subdir.file_entry("F39")
+    assert f
+    i = subdir.entry_slot(f)
+    assert i is not None and subdir.entries[i] == f
+
+    subdir.add_simple_file(PlainFile(device=subdir.device, file_name="F5", data=b'x'))
+    assert subdir.file_entry("F5")
+    assert len(subdir.glob_file("*")) == 40
+
+
+def test_glob_paths_reads_shared_prefix_once(tmp_path: Path):
+    volume = Volume.create(tmp_path / "glob.po", "GLOB", total_blocks=280)
+    volume.root.add_directory("A")
+    a_entry = volume.path_entry("/A")
+    assert a_entry
+    a = volume.read_directory(a_entry)
+    a.add_directory("B")
+    b_entry = volume.path_entry("/a/b")
+    assert b_entry
+    b = volume.read_directory(b_entry)
+    for name in ("C1", "C2", "D"):
+        b.add_simple_file(PlainFile(device=volume.device, file_name=name, data=b'x'))
+
+    volume.dcache.clear()
+    mark = volume.device.mark_session()
+    entries = volume.glob_paths(["/A/B/*", "/a/b/c*", "/A/B/D", "/"])
+    assert entries[0].is_volume_dir
+    assert [e.file_name for e in entries[1:]] == ["C1", "C2", "D"]
+    assert volume.device.get_access_log('r', mark).count(b_entry.key_pointer) == 1
+
+
+def test_volume_directory_cache(tmp_path: Path):
+    volume = Volume.create(tmp_path / "cache.po", "CACHE", total_blocks=280)
+    volume.root.add_directory("SUB")
+    sub_entry = volume.path_entry("/SUB")
+    assert sub_entry
+    sub = volume.read_directory(sub_entry)
+    assert volume.read_directory(sub_entry) is sub
+    assert volume.path_entry("/SUB/FILE") is None
+
+    # changes through the shared directory are visible to later lookups
+    mark = volume.device.mark_session()
+    with volume.create_file("/SUB/FILE") as f:
+        f.write(b'data')
+    e = volume.path_entry("/sub/file")
+    assert e and volume.parent_directory(e) is sub
+    assert 'DirectoryBlock' not in [t for (_, t) in volume.device.get_typed_access_log('r', mark)]
+
+    volume.root.move_directory(sub_entry, volume.root, "MOVED")
+    assert volume.path_entry("/SUB/FILE") is None
+    assert volume.path_entry("/MOVED/FILE") == e
+
+    sub.remove_simple_file(e)
+    volume.root.remove_directory(sub_entry)
+    assert sub_entry.key_pointer not in volume.dcache.directories
+    assert volume.path_entry("/MOVED") is None
+
+
+def test_path_entry_misses_not_cached(tmp_path: Path):
+    """A path that wasn't found is found once created, even while writes are deferred."""
+    volume = Volume.create(tmp_path / "miss.po", "MISS", total_blocks=280)
+    with volume.transaction():
+        assert volume.path_entry("/NEW") is None
+        with volume.create_file("/new") as f:
+            f.write(b'data')
+        assert volume.path_entry("/NEW")
+
+
+def test_create_file_legal_name(tmp_path: Path):
+    volume = Volume.create(tmp_path / "legal.po", "LEGAL", total_blocks=280)
+    with volume.create_file("/1st file.txt") as f:
+        f.write(b'data')
+    assert volume.path_entry("/A1ST0FILE.TXT")
+    with pytest.raises(ValueError):
+        volume.create_file("/MUCH.TOO.LONG.NAME")
+
+
+def test_write_only_dirty_blocks(subdir: DirectoryFile):
+    device = subdir.device
+    n = len(subdir.block_list)
+    assert n == 4
+    e = subdir.file_entry("F30")
+    assert e
+
+    mark = device.mark_session()
+    subdir.move_simple_file(e, subdir, "RENAMED")
+    # rename just patches the block holding the entry
+    i = subdir.entry_slot(e)
+    assert i is not None
+    assert device.get_access_log('w', mark) == [subdir.block_list[DirectoryFile.slot_block(i)]]
+
+    # removal also updates the file count in the key block
+    mark = device.mark_session()
+    f = subdir.file_entry("F29")
+    assert f
+    subdir.remove_entry(f)
+    assert device.get_access_log('w', mark) == [subdir.block_list[0], subdir.block_list[DirectoryFile.slot_block(i)]]
+    subdir.add_entry(f)
+
+    for i in range(30):
+        entry = subdir.file_entry(f"F{i}")
+        assert entry
+        subdir.remove_simple_file(entry)
+    assert len(subdir.block_list) == n
+
+    subdir.compact()
+    assert len(subdir.block_list) == 1
+    assert [e.file_name for e in subdir.glob_file("*")] == ["RENAMED"] + [f"F{i}" for i in range(31, 40)]
+    d = DirectoryFile.read(device, subdir.block_list[0])
+    assert [e.file_name for e in d.entries if e.is_active] == [e.file_name for e in subdir.entries if e.is_active]
+
+
+def test_volume_transaction(tmp_path: Path):
+    volume = Volume.create(tmp_path / "batch.po", "BATCH", total_blocks=280)
+    device = volume.device
+    root = volume.root
+    mark = device.mark_session()
+    with volume.transaction():
+        for i in range(20):
+            with volume.create_file(f"/F{i}") as f:
+                f.write(bytes([i + 1]))
+        assert len(root.glob_file("F*")) == 20
+        writes = device.get_typed_access_log('w', mark)
+        assert 'DirectoryBlock' not in [t for (_, t) in writes]
+
+    writes = device.get_typed_access_log('w', mark)
+    # each changed root block once, then the bitmap
+    assert [i for (i, t) in writes if t == 'DirectoryBlock'] == root.block_list[:2]
+    assert [t for (_, t) in writes][-1] == 'BitmapBlock'
+    assert len(DirectoryFile.read(device, root.block_list[0]).glob_file("F*")) == 20
+
+
+def test_directory_batch(subdir: DirectoryFile):
+    device = subdir.device
+    mark = device.mark_session()
+    with subdir.batch():
+        for i in range(10):
+            e = subdir.file_entry(f"F{i}")
+            assert e
+            subdir.remove_entry(e)
+        assert device.get_access_log('w', mark) == []
+    assert device.get_access_log('w', mark) == subdir.block_list[:1]
+
+
+def test_move_directory_patches_header(tmp_path: Path):
+    volume = Volume.create(tmp_path / "move.po", "MOVE", total_blocks=280)
+    root = volume.root
+    root.add_directory("SRC")
+    root.add_directory("DST")
+    src_entry, dst_entry = volume.path_entry("/SRC"), volume.path_entry("/DST")
+    assert src_entry and dst_entry
+    src = volume.read_directory(src_entry)
+    dst = volume.read_directory(dst_entry)
+    src.add_directory("SUB")
+    sub_entry = volume.path_entry("/SRC/SUB")
+    assert sub_entry
+    sub = volume.read_directory(sub_entry)
+    for i in range(20):
+        sub.add_simple_file(PlainFile(device=volume.device, file_name=f"F{i}", data=b'x'))
+    assert len(sub.block_list) == 2
+
+    volume.dcache.clear()
+    mark = volume.device.mark_session()
+    src.move_directory(sub_entry, dst, "MOVED")
+    # only the key block of the moved directory is touched
+    assert sub.block_list[1] not in volume.device.get_access_log('rw', mark)
+
+    moved = DirectoryFile.read(volume.device, sub_entry.key_pointer)
+    assert isinstance(moved.header, SubdirectoryHeaderEntry)
+    assert moved.header.file_name == "MOVED"
+    assert moved.header.parent_pointer == dst.block_list[0]
+    assert dst.entries[moved.header.parent_entry_number] == sub_entry
+
+
+def test_volume_transaction_rollback(tmp_path: Path):
+    volume = Volume.create(tmp_path / "abort.po", "ABORT", total_blocks=280)
+    volume.root.add_directory("SRC")
+    volume.root.add_directory("DST")
+    keep = bytes(range(256)) * 8
+    with volume.create_file("/SRC/KEEP") as f:
+        f.write(keep)
+    with volume.create_file("/GONE") as f:
+        f.write(b'gone' * 200)
+    free = volume.device.blocks_free
+    with pytest.raises(RuntimeError):
+        with volume.transaction():
+            gone = volume.path_entry("/GONE")
+            assert gone
+            volume.root.remove_simple_file(gone)
+            for i in range(20):
+                with volume.create_file(f"/F{i}") as f:
+                    f.write(bytes([i + 1]) * 600)
+            src = volume.path_entry("/SRC")
+            dst = volume.path_entry("/DST")
+            assert src and dst
+            volume.root.move_directory(src, volume.read_directory(dst), "MOVED")
+            raise RuntimeError("abort")
+
+    assert volume.device.blocks_free == free
+    assert volume.path_entry("/F0") is None
+    # removed files come back intact, since their blocks were never freed
+    gone = volume.path_entry("/GONE")
+    assert gone and volume.read_simple_file(gone).data == b'gone' * 200
+    sub = volume.path_entry("/SRC")
+    kept = volume.path_entry("/SRC/KEEP")
+    assert sub and kept and volume.read_simple_file(kept).data == keep
+    d = DirectoryFile.read(volume.device, sub.key_pointer)
+    assert d.file_name == "SRC" and isinstance(d.header, SubdirectoryHeaderEntry)
+    assert d.header.parent_pointer == volume.root.block_list[0]
+    # the bitmap written on the way out is the one from before the transaction
+    assert Volume.from_file(tmp_path / "abort.po").device.blocks_free == free
+
+
+def test_compact_patches_subdirectory_headers(subdir: DirectoryFile):
+    subdir.add_directory("NESTED")
+    nested = subdir.file_entry("NESTED")
+    assert nested
+    for i in range(40):
+        entry = subdir.file_entry(f"F{i}")
+        assert entry
+        subdir.remove_simple_file(entry)
+    subdir.compact()
+    assert len(subdir.block_list) == 1
+    d = DirectoryFile.read(subdir.device, nested.key_pointer)
+    assert isinstance(d.header, SubdirectoryHeaderEntry)
+    assert d.header.parent_entry_number == 0
+    assert subdir.entries[d.header.parent_entry_number] == nested
+
+
+def test_remove_simple_file_reads_only_index_blocks(tmp_path: Path):
+    volume = Volume.create(tmp_path / "rm.po", "RM", total_blocks=1600)
+    device = volume.device
+    free = device.blocks_free
+    volume.root.add_simple_file(PlainFile(device=device, file_name="TREE", data=b'x' * 300 * 512))
+    entry = volume.root.file_entry("TREE")
+    assert entry
+    mark = device.mark_session()
+    with volume.transaction():
+        volume.root.remove_simple_file(entry)
+        # freed once the entry's removal is written
+        assert device.blocks_free < free
+    assert {t for (_, t) in device.get_typed_access_log('r', mark)} == {'IndexBlock'}
+    assert device.blocks_free == free
+
+
+def test_transaction_rollback_with_block_cache(tmp_path: Path):
+    """Directories don't change the device's shared cached blocks, so a rollback undoes a rename."""
+    path = tmp_path / "cached.po"
+    volume = Volume.create(path, "CACHED", total_blocks=280)
+    with volume.create_file("/OLD") as f:
+        f.write(b'old')
+    volume.device.flush()
+
+    volume = Volume.from_file(path, 'rw', cache_size=64)
+    entry = volume.path_entry("/OLD")
+    assert entry
+    with pytest.raises(RuntimeError):
+        with volume.transaction():
+            volume.root.move_simple_file(entry, volume.root, "NEW")
+            raise RuntimeError("abort")
+    assert volume.path_entry("/OLD")
+    assert volume.path_entry("/NEW") is None
+
+
+def test_compact_in_transaction(tmp_path: Path):
+    """Compaction in a transaction waits for the commit to write the directory and free its blocks."""
+    volume = Volume.create(tmp_path / "compact.po", "COMPACT", total_blocks=280)
+    volume.root.add_directory("SUB")
+    entry = volume.path_entry("/SUB")
+    assert entry
+    sub = volume.read_directory(entry)
+    for i in range(30):
+        sub.add_simple_file(PlainFile(device=volume.device, file_name=f"F{i}", data=bytes([i+1])))
+    blocks = list(sub.block_list)
+    assert len(blocks) == 3
+
+    device = volume.device
+    mark = device.mark_session()
+    with volume.transaction():
+        for i in range(25):
+            e = sub.file_entry(f"F{i}")
+            assert e
+            sub.remove_entry(e)
+        sub.compact()
+        assert device.get_access_log('wf', mark) == []
+    assert sub.block_list == blocks[:1]
+    assert set(blocks[1:]) <= set(device.get_access_log('f', mark))
+    d = DirectoryFile.read(device, blocks[0])
+    assert [e.file_name for e in d.entries if e.is_active] == [f"F{i}" for i in range(25, 30)]
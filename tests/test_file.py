@@ -106,3 +106,87 @@ def test_plain_file_prodos():
     # Verify file has data
     assert len(prodos_file.data) == prodos_file.file_size
     assert prodos_file.data[:2] == b'L\xfc'  # ProDOS system file starts with JMP instruction (4C FC)
+
+
+def test_plain_file_contiguous_write(tmp_path: Path):
+    """Test that a file is written to a single extent rather than the first free holes."""
+    volume = Volume.create(tmp_path / "frag.po", "FRAG", total_blocks=280)
+    device = volume.device
+    root = volume.root
+
+    # fragment free space with single block holes
+    for i in range(4):
+        root.add_simple_file(PlainFile(device=device, file_name=f"F{i}", data=b'x'))
+    for i in (0, 2):
+        e = root.file_entry(f"F{i}")
+        assert e
+        root.remove_simple_file(e)
+
+    f = PlainFile(device=device, file_name="BIG", data=b'y' * 3 * block_size)
+    root.add_simple_file(f)
+    assert f.block_list == list(range(f.block_list[0], f.block_list[0] + 4))
+
+    g = PlainFile(device=device, file_name="SCATTER", data=b'z' * 3 * block_size)
+    g.write(contiguous=False)
+    assert g.block_list != list(range(g.block_list[0], g.block_list[0] + 4))
+    assert PlainFile.from_entry(device, g.entry(2)).data == g.data
+
+
+@pytest.mark.parametrize('size', [0, 100, 3 * block_size, 300 * block_size])
+def test_plain_file_walk_blocks(tmp_path: Path, size: int):
+    """Test that walking block pointers matches the blocks read, without reading data."""
+    volume = Volume.create(tmp_path / "walk.po", "WALK", total_blocks=1600)
+    device = volume.device
+    # leave a sparse hole in larger files
+    data = bytearray(b'w' * size)
+    data[block_size:2*block_size] = bytes(min(block_size, max(0, size - block_size)))
+    f = PlainFile(device=device, file_name="WALK", data=bytes(data))
+    volume.root.add_simple_file(f)
+    entry = volume.root.file_entry("WALK")
+    assert entry
+
+    mark = device.mark_session()
+    blocks = list(PlainFile.walk_blocks(device, entry))
+    assert all(t == 'IndexBlock' for (_, t) in device.get_typed_access_log('r', mark))
+
+    mark = device.mark_session()
+    PlainFile.read_into(device, entry, bytearray(entry.eof))
+    assert blocks == device.get_typed_access_log('r', mark)
+
+    # the block list is collected while reading, so each block is read once
+    mark = device.mark_session()
+    g = PlainFile.from_entry(device, entry)
+    assert blocks == device.get_typed_access_log('r', mark)
+    assert g.block_list == PlainFile.block_list_from_entry(device, entry) == [i for (i, _) in blocks]
+    assert sorted(g.block_list) == sorted(f.block_list)
+    assert len(g.block_list) == entry.blocks_used
+
+
+def test_plain_file_read_into(tmp_path: Path):
+    """Test reading a sparse file into a caller buffer zero fills the holes."""
+    volume = Volume.create(tmp_path / "into.po", "INTO", total_blocks=280)
+    data = b'a' * block_size + bytes(2 * block_size) + b'b' * 10
+    volume.root.add_simple_file(PlainFile(device=volume.device, file_name="HOLEY", data=data))
+    entry = volume.root.file_entry("HOLEY")
+    assert entry
+
+    buf = bytearray(b'\xff' * (len(data) + 5))
+    assert PlainFile.read_into(volume.device, entry, buf) == len(data)
+    assert buf[:len(data)] == data
+    assert buf[len(data):] == b'\xff' * 5
+
+
+def test_plain_file_export_sparse(tmp_path: Path):
+    """Test that export only writes allocated data blocks, leaving holes."""
+    volume = Volume.create(tmp_path / "sparse.po", "SPARSE", total_blocks=280)
+    data = bytes(4 * block_size) + b'c' * 100 + bytes(300 * block_size)
+    volume.root.add_simple_file(PlainFile(device=volume.device, file_name="SPARSE", data=data))
+    entry = volume.root.file_entry("SPARSE")
+    assert entry
+
+    extents = list(PlainFile.data_extents(volume.device, entry))
+    assert [(offset, length) for (offset, _, length) in extents] == [(4 * block_size, block_size)]
+
+    dst = tmp_path / "sparse.bin"
+    PlainFile.export_entry(volume.device, entry, str(dst))
+    assert dst.read_bytes() == data
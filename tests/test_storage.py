@@ -0,0 +1,82 @@
+"""Tests for the block storage backends under BlockDevice."""
+from pathlib import Path
+
+import pytest
+
+from prodos.file import PlainFile
+from prodos.storage import FileStorage, MemoryStorage, MmapStorage, StorageBackend, open_storage
+from prodos.volume import Volume
+
+
+@pytest.mark.parametrize('backend', ['mmap', 'file', 'memory'])
+def test_backend_round_trip(tmp_path: Path, backend: StorageBackend):
+    """Volumes created and updated with each backend read back the same via mmap."""
+    img_path = tmp_path / "vol.po"
+    volume = Volume.create(img_path, "ROUND", total_blocks=280, backend=backend)
+    data = bytes(range(256)) * 9
+    with volume.create_file('/DATA') as f:
+        f.write(data)
+    volume.device.flush()
+
+    volume = Volume.from_file(img_path, mode='rw', backend=backend)
+    with volume.create_file('/MORE') as f:
+        f.write(b'more')
+    volume.device.flush()
+
+    copy = Volume.from_file(img_path)
+    data_entry, more_entry = copy.path_entry('/DATA'), copy.path_entry('/MORE')
+    assert data_entry and more_entry
+    assert PlainFile.from_entry(copy.device, data_entry).data == data
+    assert PlainFile.from_entry(copy.device, more_entry).data == b'more'
+    assert copy.device.blocks_free == volume.device.blocks_free
+
+
+def test_memory_create_writes_once(tmp_path: Path):
+    """A volume created in memory only reaches the host file when flushed."""
+    img_path = tmp_path / "ram.po"
+    volume = Volume.create(img_path, "RAM", total_blocks=280, backend='memory')
+    assert isinstance(volume.device.storage, MemoryStorage)
+    assert not img_path.exists()
+    volume.device.flush()
+    assert img_path.stat().st_size == 280 * 512
+    mtime = img_path.stat().st_mtime_ns
+    volume.device.flush()
+    assert img_path.stat().st_mtime_ns == mtime
+
+
+def test_memory_transactions_write_once(tmp_path: Path):
+    """Transactions on an in-memory volume leave writing the image to the final flush."""
+    img_path = tmp_path / "ram.po"
+    volume = Volume.create(img_path, "RAM", total_blocks=280, backend='memory')
+    for i in range(5):
+        with volume.transaction():
+            with volume.create_file(f'/F{i}') as f:
+                f.write(b'data')
+    assert not img_path.exists()
+    volume.device.flush()
+    copy = Volume.from_file(img_path)
+    assert len(copy.glob_paths(['/F*'])) == 5
+
+
+def test_open_storage(tmp_path: Path):
+    img_path = tmp_path / "raw.po"
+    img_path.write_bytes(bytes(1024))
+    assert isinstance(open_storage(img_path), MmapStorage)
+    storage = open_storage(img_path, 'rw', 'file')
+    assert isinstance(storage, FileStorage) and storage.buffer() is None
+    storage.write(512, b'abc')
+    assert bytes(storage.view(511, 5)) == b'\0abc\0'
+    storage.close()
+    with pytest.raises(ValueError):
+        open_storage(img_path, 'ro', 'tape')  # type: ignore
+
+
+@pytest.mark.parametrize('backend', ['mmap', 'file', 'memory'])
+def test_discard(tmp_path: Path, backend: StorageBackend):
+    """Discarding an unaligned range zeros exactly that range, whether or not holes are punched."""
+    img_path = tmp_path / "discard.po"
+    img_path.write_bytes(b'\xff' * 20000)
+    storage = open_storage(img_path, 'rw', backend)
+    storage.discard(100, 15000)
+    data = bytes(storage.view(0, 20000))
+    assert data == b'\xff' * 100 + bytes(15000) + b'\xff' * 4900
@@ -0,0 +1,230 @@
+"""Tests for streaming access to simple files."""
+import io
+from pathlib import Path
+
+import pytest
+
+from prodos.file import PlainFile
+from prodos.globals import block_size
+from prodos.metadata import FileEntry, StorageType
+from prodos.stream import copy_sparse
+from prodos.volume import Volume
+
+sizes = {
+    'SEED': 300,
+    'SAPLING': 5 * block_size + 17,
+    'TREE': 300 * block_size + 5,
+}
+
+
+@pytest.fixture
+def volume(tmp_path: Path) -> Volume:
+    volume = Volume.create(tmp_path / "stream.po", "STREAM", total_blocks=1600)
+    root = volume.root
+    for name, n in sizes.items():
+        data = bytes((i * 7 + len(name)) & 0xff for i in range(n))
+        root.add_simple_file(PlainFile(device=volume.device, file_name=name, data=data))
+    # sparse tree file with data at start and end only
+    sparse = bytearray(260 * block_size)
+    sparse[:3] = b'abc'
+    sparse[-3:] = b'xyz'
+    root.add_simple_file(PlainFile(device=volume.device, file_name='SPARSE', data=bytes(sparse)))
+    return volume
+
+
+def entry(volume: Volume, name: str) -> FileEntry:
+    e = volume.path_entry(name)
+    assert e
+    return e
+
+
+@pytest.mark.parametrize('name', [*sizes, 'SPARSE'])
+def test_reader_matches_file(volume: Volume, name: str):
+    e = entry(volume, name)
+    expected = volume.read_simple_file(e).data
+    with volume.open(e) as f:
+        assert f.readall() == expected
+        assert f.read() == b''
+        f.seek(0)
+        chunks = iter(lambda: f.read(1000), b'')
+        assert b''.join(chunks) == expected
+
+
+def test_reader_storage_types(volume: Volume):
+    assert entry(volume, 'SEED').storage_type == StorageType.seedling
+    assert entry(volume, 'SAPLING').storage_type == StorageType.sapling
+    assert entry(volume, 'TREE').storage_type == StorageType.tree
+
+
+def test_reader_seek_and_readinto(volume: Volume):
+    e = entry(volume, 'TREE')
+    expected = volume.read_simple_file(e).data
+    f = volume.open(e)
+    assert f.seekable()
+    for pos in (0, 511, 512, 1 << 17, (1 << 17) - 3, e.eof - 10):
+        f.seek(pos)
+        buf = bytearray(20)
+        n = f.readinto(buf)
+        assert n == min(20, e.eof - pos)
+        assert bytes(buf[:n]) == expected[pos:pos+n]
+    assert f.seek(-5, io.SEEK_END) == e.eof - 5
+    assert f.read() == expected[-5:]
+
+
+def test_reader_sparse_reads_only_touched_blocks(volume: Volume):
+    e = entry(volume, 'SPARSE')
+    device = volume.device
+    with volume.open(e) as f:
+        mark = device.mark_session()
+        f.seek(100 * block_size)
+        assert f.read(block_size) == bytes(block_size)
+        f.seek(-3, io.SEEK_END)
+        assert f.read() == b'xyz'
+        # master block, the two index blocks and the last data block
+        assert len(device.get_access_log('r', mark)) == 4
+
+
+@pytest.mark.parametrize('size,storage_type', [
+    (0, StorageType.seedling),
+    (block_size, StorageType.seedling),
+    (block_size + 1, StorageType.sapling),
+    (256 * block_size, StorageType.sapling),
+    (256 * block_size + 1, StorageType.tree),
+    (300 * block_size + 5, StorageType.tree),
+])
+def test_writer_storage_types(volume: Volume, size: int, storage_type: StorageType):
+    data = bytes((i * 13) & 0xff | 1 for i in range(size))
+    with volume.create_file('/WRITTEN') as f:
+        # write in uneven chunks to exercise partial blocks
+        for i in range(0, size, 1000):
+            f.write(data[i:i+1000])
+
+    e = entry(volume, 'WRITTEN')
+    assert e.storage_type == storage_type
+    assert e.eof == size
+    pf = volume.read_simple_file(e)
+    assert pf.data == data
+    assert e.blocks_used == len(pf.block_list)
+
+    # same layout as an in-memory write
+    expected = PlainFile(device=volume.device, file_name='EXPECTED', data=data)
+    volume.root.add_simple_file(expected)
+    assert e.blocks_used == len(expected.block_list)
+
+
+def test_writer_sparse(volume: Volume):
+    free = volume.device.blocks_free
+    with volume.create_file('/HOLEY') as f:
+        f.write(b'abc')
+        f.write(bytes(200 * block_size))
+        f.write(b'xyz')
+    e = entry(volume, 'HOLEY')
+    assert e.storage_type == StorageType.sapling
+    # index block plus first and last data blocks
+    assert e.blocks_used == 3
+    assert free - volume.device.blocks_free == 3
+    with volume.open(e) as r:
+        data = r.readall()
+    assert data[:3] == b'abc' and data[-3:] == b'xyz' and not any(data[3:-3])
+
+
+def test_writer_seek_makes_hole(volume: Volume):
+    with volume.create_file('/SEEKED') as f:
+        f.write(b'abc')
+        f.seek(270 * block_size)
+        f.write(b'xyz')
+        f.seek(10, io.SEEK_CUR)
+        with pytest.raises(ValueError):
+            f.seek(0)
+    e = entry(volume, 'SEEKED')
+    assert e.storage_type == StorageType.tree
+    assert e.eof == 270 * block_size + 13
+    # master, two index and two data blocks
+    assert e.blocks_used == 5
+    data = volume.read_simple_file(e).data
+    assert data[:3] == b'abc' and data[-13:] == b'xyz' + bytes(10) and not any(data[3:-13])
+
+
+def test_copy_sparse(volume: Volume, tmp_path: Path):
+    host = tmp_path / "host.bin"
+    with open(host, 'wb') as f:
+        f.write(b'head')
+        f.seek(100 * block_size)
+        f.write(b'tail')
+        f.truncate(200 * block_size)
+    with open(host, 'rb') as src, volume.create_file('/COPIED') as dst:
+        copy_sparse(src, dst)
+    e = entry(volume, 'COPIED')
+    assert e.eof == 200 * block_size
+    assert e.blocks_used == 3
+    assert volume.read_simple_file(e).data == host.read_bytes()
+
+
+def test_writer_replaces_existing(volume: Volume):
+    with volume.create_file('/SEED') as f:
+        f.write(b'new')
+    e = entry(volume, 'SEED')
+    assert volume.read_simple_file(e).data == b'new'
+    assert len(volume.glob_paths(['/SEED'])) == 1
+
+
+def test_writer_abort_frees_blocks(volume: Volume):
+    free = volume.device.blocks_free
+    with pytest.raises(RuntimeError):
+        with volume.create_file('/ABORTED') as f:
+            f.write(bytes(range(256)) * 20)
+            raise RuntimeError("interrupted")
+    assert volume.path_entry('/ABORTED') is None
+    assert volume.device.blocks_free == free
+
+
+@pytest.mark.parametrize('size', [5 * block_size + 17, 300 * block_size + 5])
+def test_copy_sparse_contiguous(volume: Volume, tmp_path: Path, size: int):
+    """Imported files are laid out in one extent, key block first, like PlainFile.write."""
+    host = tmp_path / "dense.bin"
+    host.write_bytes(bytes((i * 11) & 0xff | 1 for i in range(size)))
+    free = volume.device.blocks_free
+    with open(host, 'rb') as src, volume.create_file('/DENSE') as dst:
+        copy_sparse(src, dst)
+    e = entry(volume, 'DENSE')
+    blocks = PlainFile.block_list_from_entry(volume.device, e)
+    assert blocks == list(range(blocks[0], blocks[0] + e.blocks_used))
+    assert free - volume.device.blocks_free == e.blocks_used
+    assert volume.read_simple_file(e).data == host.read_bytes()
+
+
+def test_writer_close_error_frees_blocks(volume: Volume, monkeypatch: pytest.MonkeyPatch):
+    free = volume.device.blocks_free
+    f = volume.create_file('/BROKEN')
+    f.write(bytes(range(256)) * 20)
+
+    def fail(*args: object):
+        raise RuntimeError("disk on fire")
+    monkeypatch.setattr(volume.device, 'write_typed_block', fail)
+    with pytest.raises(RuntimeError):
+        f.close()
+    assert f.closed
+    assert volume.path_entry('/BROKEN') is None
+    assert volume.device.blocks_free == free
+
+
+def test_writer_unclosed_is_discarded(volume: Volume):
+    """A writer that's garbage collected without being closed doesn't add its file."""
+    free = volume.device.blocks_free
+    f = volume.create_file('/DROPPED')
+    f.write(bytes(range(256)) * 20)
+    del f
+    assert volume.path_entry('/DROPPED') is None
+    assert volume.device.blocks_free == free
+
+
+def test_writer_fills_volume(volume: Volume):
+    """A file that just fits is written even when the next chunk of blocks isn't free."""
+    device = volume.device
+    device.allocate_blocks(device.blocks_free - 11)
+    data = bytes(range(256)) * 16
+    with volume.create_file('/SNUG') as f:
+        f.write(data)
+    e = volume.path_entry('/SNUG')
+    assert e and volume.read_simple_file(e).data == data
+    assert device.blocks_free == 2